@@ -6,8 +6,22 @@ from blinky.travis import *
 
 http_port = 8080
 
+# Threads for blocking requests, by pool.  The proxy and the error
+# pages fetch from other servers, and each has its own pool.  The
+# data resources compress each new snapshot on first use.
+# http_pool_sizes = {"default": 8, "data": 8, "proxy": 16, "errors": 8}
+
 model.title = "Test CI"
 
+# Keep a record of past job results
+# model.history = HistoryStore("/var/lib/blinky/history.db")
+
+# Serve the last known results immediately after a restart
+# model.state_file = "/var/lib/blinky/state.json"
+
+# Send a second request when one is slower than usual for its host
+# model.transport.hedging = True
+
 # Components
 
 proton_c = Component(model, "Proton C")
@@ -20,6 +34,9 @@ multiple = Environment(model, "Multiple OSes")
 
 github = GitHubAgent(model, "GitHub")
 
+# To spread requests across several API tokens:
+# github = GitHubAgent(model, "GitHub", tokens=["<token-1>", "<token-2>"])
+
 # Categories
 
 client_tests = Category(model, "Clients", "client")
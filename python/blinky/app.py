@@ -18,12 +18,17 @@
 #
 
 import brbn as _brbn
+import codecs as _codecs
+import collections as _collections
+import concurrent.futures as _futures
 import json as _json
 import logging as _logging
 import os as _os
 import re as _re
 import requests as _requests
 import sys as _sys
+import threading as _threading
+import time as _time
 
 _log = _logging.getLogger("blinky.app")
 
@@ -32,39 +37,134 @@ class Blinky(_brbn.Application):
         super().__init__(home)
 
         self.model = model
+        self.fetch_cache = _FetchCache()
+        self.error_pages = _ErrorPageCache()
+
+        # The proxy and the error pages wait on other servers.  Each
+        # gets a bounded pool of its own, so neither can hold up the
+        # other or the rest of the application.
+        self.pool_sizes["proxy"] = 16
+        self.pool_sizes["errors"] = 8
+
+        # The data resources make each snapshot's compressed and
+        # columnar forms on first use, so they run on a pool of their
+        # own
+        self.pool_sizes["data"] = 8
 
         _Data(self, "/data.json")
+        _DataDelta(self, "/data-delta.json")
         _Errors(self, "/errors.html")
         _Proxy(self, "/proxy")
 
-class _Data(_brbn.Resource):
+        self.events = _brbn.EventStream(self, "/events")
+
+        self.model.check_listeners.append(self._notify_clients)
+
+    # Clients are told after every agent update.  If the version is
+    # new, they fetch the changes.  If not, the update times still
+    # show them that the data is current.
+    def _notify_clients(self, model):
+        data = _json.dumps(model.render_check_data())
+        self.events.publish(data, event="update")
+
+    def get_snapshot(self):
+        snapshot = self.model.snapshot
+
+        if snapshot is None:
+            raise _brbn.Error("The model isn't updated yet")
+
+        return snapshot
+
+# Each request reads the model's snapshot once, so the ETag and the
+# body always match
+class _SnapshotResource(_brbn.Resource):
+    blocking = True
+    pool = "data"
+
+    def process(self, request):
+        request.snapshot = self.app.get_snapshot()
+
+    def get_etag(self, request):
+        return request.snapshot.digest
+
+# The compact columnar format is sent if the request has format=2
+class _Data(_SnapshotResource):
+    def process(self, request):
+        super().process(request)
+
+        request.columnar = request.get("format") == "2"
+        request.json = request.snapshot.json
+        request.variants = request.snapshot.variants
+
+        if request.columnar:
+            request.json = request.snapshot.columnar_json
+            request.variants = request.snapshot.columnar_variants
+
     def get_etag(self, request):
-        return self.app.model.json_digest
+        etag = super().get_etag(request)
+
+        if request.columnar:
+            etag = "{}-2".format(etag)
+
+        return etag
+
+    def get_encodings(self, request):
+        return list(request.variants)
+
+    def render(self, request):
+        return request.json
+
+    def render_encoded(self, request, encoding):
+        return request.variants[encoding]
+
+# Full deltas are sent compressed.  Partial deltas are small and
+# different for each client, so they are sent as is.
+class _DataDelta(_SnapshotResource):
+    def process(self, request):
+        super().process(request)
+
+        request.since = request.get("since")
+        request.full = request.snapshot.is_delta_full(request.since)
+
+    def get_encodings(self, request):
+        if request.full:
+            return list(request.snapshot.full_delta_variants)
 
     def render(self, request):
-        return self.app.model.json
+        return request.snapshot.render_delta(request.since)
+
+    def render_encoded(self, request, encoding):
+        return request.snapshot.full_delta_variants[encoding]
 
 class _Errors(_brbn.Resource):
+    blocking = True
+    pool = "errors"
+
     def process(self, request):
-        url = request.require("url")
+        request.url = request.require("url")
+        request.page = self.app.error_pages.get(request.url)
 
-        response = _requests.get(url)
-        request.proxied_content = response.text
+        # Wait for the log to open, so connection errors produce an
+        # error page.  The rest is sent as it is rendered.
+        request.page.wait_opened()
 
     def render(self, request):
-        pass
+        return iter(request.page)
 
 class _Proxy(_brbn.Resource):
+    blocking = True
+    pool = "proxy"
+
     def process(self, request):
         url = request.require("url")
 
         if url == "/data.json":
-            request.proxied_content = self.app.resources[url].render(request)
+            request.proxied_content = self.app.get_snapshot().json
             request.proxied_content_type = "application/json"
         else:
-            response = _requests.get(url)
-            request.proxied_content = response.text
-            request.proxied_content_type = response.headers["content-type"]
+            response = self.app.fetch_cache.get(url)
+            request.proxied_content = response.content
+            request.proxied_content_type = response.content_type
 
     def get_content_type(self, request):
         return request.proxied_content_type
@@ -72,71 +172,355 @@ class _Proxy(_brbn.Resource):
     def render(self, request):
         return request.proxied_content
 
-_lines_before = 5
-_lines_after = 20
+# Upstream fetches for the proxy and error pages.  Concurrent requests
+# for the same URL share one fetch, and the results are kept for a
+# short time in a size-bounded LRU cache.
+class _FetchCache:
+    def __init__(self, max_age=60, max_bytes=64 * 1024 * 1024):
+        self.max_age = max_age       # Seconds
+        self.max_bytes = max_bytes   # Total content size
 
-_error_expr = _re.compile(r"(^|\s|\*)(error|fail|failed|failure|timeout)s?($|\s|:)", _re.IGNORECASE)
+        self._entries = _collections.OrderedDict() # [Fetch time, future, size] by URL
+        self._size = 0
+        self._lock = _threading.Lock()
 
-def _find_error_windows(lines):
-    matching_lines = list()
+    def get(self, url):
+        now = _time.monotonic()
 
-    for index, line in enumerate(lines):
-        if _re.search(_error_expr, line):
-            matching_lines.append(index)
+        with self._lock:
+            entry = self._entries.get(url)
 
-    # Filter out known false positives
+            if entry is not None and now - entry[0] < self.max_age:
+                self._entries.move_to_end(url)
+                future = entry[1]
+            else:
+                self._remove(url)
 
-    filtered_lines = list()
+                entry = self._entries[url] = [now, _futures.Future(), 0]
+                future = None
 
-    for index in matching_lines:
-        line = lines[index]
+        if future is not None:
+            return future.result()
 
-        if "Failures: 0, Errors: 0" in line:
-            continue
+        try:
+            response = _fetch(url)
+        except Exception as e:
+            with self._lock:
+                self._remove(url, entry)
 
-        if "-- Performing Test" in line:
-            continue
+            entry[1].set_exception(e)
+            raise
 
-        if "timeout=" in line:
-            continue
+        with self._lock:
+            if response.status_code != 200:
+                self._remove(url, entry)
+            elif self._entries.get(url) is entry:
+                entry[2] = len(response.content)
+                self._size += entry[2]
 
-        if "Test timeout computed to be" in line:
-            continue
+                while self._size > self.max_bytes and len(self._entries) > 1:
+                    self._remove(next(iter(self._entries)))
 
-        filtered_lines.append(index)
+        entry[1].set_result(response)
 
-    # Compute windows
+        return response
 
-    windows = list()
+    def _remove(self, url, entry=None):
+        if entry is not None and self._entries.get(url) is not entry:
+            return
 
-    for index in filtered_lines:
-        start = max(0, index - _lines_before)
-        end = min(len(lines), index + _lines_after)
+        entry = self._entries.pop(url, None)
 
-        windows.append((start, end))
+        if entry is not None:
+            self._size -= entry[2]
 
-    # Collapse overlapping windows
+# Error pages, each rendered from one read of the log.  Requests for a
+# page still being rendered follow along as it grows, so many viewers
+# of the same log cause one upstream fetch.  Finished pages are kept
+# for a short time in a size-bounded LRU cache.
+class _ErrorPageCache:
+    def __init__(self, max_age=60, max_bytes=64 * 1024 * 1024, max_renders=8):
+        self.max_age = max_age       # Seconds
+        self.max_bytes = max_bytes   # Total size of the finished pages
 
-    collapsed_windows = list()
-    collapsed_window = None
+        self._entries = _collections.OrderedDict() # [Page, size] by URL
+        self._size = 0
+        self._lock = _threading.Lock()
+        self._executor = _futures.ThreadPoolExecutor(max_renders, "errors-render")
 
-    for window in windows:
-        if collapsed_window is None:
-            collapsed_window = window
+    def get(self, url):
+        now = _time.monotonic()
 
-        if window[0] < collapsed_window[1]:
-            collapsed_window = collapsed_window[0], window[1]
-        else:
-            collapsed_windows.append(collapsed_window)
-            collapsed_window = window
+        with self._lock:
+            entry = self._entries.get(url)
+
+            if entry is not None and (entry[0].finish_time is None or now - entry[0].finish_time < self.max_age):
+                self._entries.move_to_end(url)
+                return entry[0]
+
+            self._remove(url)
+
+            entry = self._entries[url] = [_ErrorPage(url), 0]
+
+        self._executor.submit(self._render, entry)
+
+        return entry[0]
+
+    def _render(self, entry):
+        page = entry[0]
+        page.render()
+
+        with self._lock:
+            if page.failed:
+                self._remove(page.url, entry)
+            elif self._entries.get(page.url) is entry:
+                entry[1] = page.size
+                self._size += entry[1]
+
+                while self._size > self.max_bytes and len(self._entries) > 1:
+                    self._remove(next(iter(self._entries)))
+
+    def _remove(self, url, entry=None):
+        if entry is not None and self._entries.get(url) is not entry:
+            return
+
+        entry = self._entries.pop(url, None)
+
+        if entry is not None:
+            self._size -= entry[1]
+
+class _ErrorPage:
+    def __init__(self, url):
+        self.url = url
+        self.chunks = list()
+        self.size = 0
+        self.opened = False
+        self.error = None        # Why the log couldn't be read
+        self.failed = False
+        self.finish_time = None  # Monotonic seconds
+
+        self._condition = _threading.Condition()
+
+    def __iter__(self):
+        index = 0
+
+        while True:
+            with self._condition:
+                while index == len(self.chunks) and self.finish_time is None:
+                    self._condition.wait()
+
+                chunks = self.chunks[index:]
+                finished = self.finish_time is not None
+
+            index += len(chunks)
+
+            if chunks:
+                yield "".join(chunks)
 
-    if collapsed_window is not None:
-        collapsed_windows.append(collapsed_window)
+            if finished and index == len(self.chunks):
+                return
 
-    # for window in windows:
-    #     print("w", window)
+    def wait_opened(self):
+        with self._condition:
+            while not self.opened and self.finish_time is None:
+                self._condition.wait()
 
-    # for window in collapsed_windows:
-    #     print("c", window)
+        if self.error is not None:
+            raise _brbn.Error("Failure fetching {}: {}".format(self.url, self.error))
 
-    return collapsed_windows
+    # Only the time it takes is limited.  Logs can be hundreds of
+    # megabytes, and the failure is usually near the end.  Memory
+    # stays bounded because only the error windows are kept.
+    def render(self):
+        try:
+            response = _requests.get(self.url, stream=True, timeout=(5, _fetch_timeout))
+        except Exception as e:
+            self.error = e
+            self.failed = True
+            self._finish()
+            return
+
+        with self._condition:
+            self.opened = True
+            self._condition.notify_all()
+
+        note = None
+
+        try:
+            with response:
+                self._append(_errors_page_head.format(url=_brbn.xml_escape(self.url)))
+
+                lines = _iter_log_lines(response, _time.monotonic() + _fetch_timeout)
+
+                for start, end, window_lines in _iter_error_windows(lines):
+                    content = _brbn.xml_escape("\n".join(window_lines))
+                    self._append("<h2>Lines {}-{}</h2>\n<pre>{}</pre>\n".format(start + 1, end, content))
+        except _LogTimeout:
+            note = "Stopped after reading the log for {} seconds".format(_fetch_timeout)
+        except Exception as e:
+            _log.exception("Failure reading {}".format(self.url))
+
+            note = "Failure reading the log: {}".format(e)
+            self.failed = True
+
+        if note is not None:
+            self._append("<p><b>{}</b></p>\n".format(_brbn.xml_escape(note)))
+
+        self._append(_errors_page_foot)
+        self._finish()
+
+    def _append(self, chunk):
+        with self._condition:
+            self.chunks.append(chunk)
+            self.size += len(chunk)
+            self._condition.notify_all()
+
+    def _finish(self):
+        with self._condition:
+            self.finish_time = _time.monotonic()
+            self._condition.notify_all()
+
+class _LogTimeout(Exception):
+    pass
+
+# Decode and split the log as it arrives.  Raises _LogTimeout at the
+# deadline.
+def _iter_log_lines(response, deadline):
+    decoder = _codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    pending = ""
+
+    for chunk in response.iter_content(64 * 1024):
+        if _time.monotonic() > deadline:
+            raise _LogTimeout()
+
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+
+        for line in lines:
+            yield line.rstrip("\r")
+
+    pending += decoder.decode(b"", final=True)
+
+    if pending:
+        yield pending.rstrip("\r")
+
+class _FetchedResponse:
+    def __init__(self, status_code, content_type, encoding, content):
+        self.status_code = status_code
+        self.content_type = content_type
+        self.encoding = encoding
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+_fetch_timeout = 30 # Seconds
+_fetch_max_size = 16 * 1024 * 1024 # Bytes
+
+def _fetch(url):
+    deadline = _time.monotonic() + _fetch_timeout
+
+    with _requests.get(url, stream=True, timeout=(5, _fetch_timeout)) as response:
+        content_length = int(response.headers.get("Content-Length", 0))
+
+        if content_length > _fetch_max_size:
+            raise _brbn.Error("The response from {} is too large ({} bytes)".format(url, content_length))
+
+        chunks = list()
+        size = 0
+
+        for chunk in response.iter_content(64 * 1024):
+            size += len(chunk)
+
+            if size > _fetch_max_size:
+                raise _brbn.Error("The response from {} is larger than {} bytes".format(url, _fetch_max_size))
+
+            if _time.monotonic() > deadline:
+                raise _brbn.Error("The response from {} took longer than {} seconds".format(url, _fetch_timeout))
+
+            chunks.append(chunk)
+
+        content_type = response.headers.get("Content-Type", "application/octet-stream")
+
+        return _FetchedResponse(response.status_code, content_type, response.encoding, b"".join(chunks))
+
+_errors_page_head = """<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <head>
+    <title>Errors</title>
+    <meta charset="utf-8"/>
+    <link rel="stylesheet" href="/app.css" type="text/css"/>
+  </head>
+  <body>
+    <h1>Errors in <a href="{url}">{url}</a></h1>
+"""
+
+_errors_page_foot = """  </body>
+</html>
+"""
+
+_lines_before = 5
+_lines_after = 20
+_max_window_lines = 1000
+
+_error_expr = _re.compile(r"(^|\s|\*)(error|fail|failed|failure|timeout)s?($|\s|:)", _re.IGNORECASE)
+
+def _is_error_line(line):
+    if not _re.search(_error_expr, line):
+        return False
+
+    # Filter out known false positives
+
+    if "Failures: 0, Errors: 0" in line:
+        return False
+
+    if "-- Performing Test" in line:
+        return False
+
+    if "timeout=" in line:
+        return False
+
+    if "Test timeout computed to be" in line:
+        return False
+
+    return True
+
+# Yield (start, end, lines) for each window of lines around errors,
+# in one pass and as soon as each window is complete.  Only the
+# preceding _lines_before lines and the current window are kept in
+# memory.  Overlapping windows are collapsed.
+def _iter_error_windows(lines):
+    preceding = _collections.deque(maxlen=_lines_before)
+    window = None # [start, end, lines]
+    index = -1
+
+    for index, line in enumerate(lines):
+        if window is not None:
+            start, end, window_lines = window
+
+            if index >= end + _lines_before or len(window_lines) >= _max_window_lines:
+                yield start, min(end, index), window_lines
+                window = None
+            elif index < end:
+                window_lines.append(line)
+
+        if _is_error_line(line):
+            if window is None:
+                window = [max(0, index - _lines_before), None, list(preceding) + [line]]
+            elif index >= window[1]:
+                # Close enough to the end of the current window that
+                # this error's window overlaps it
+                gap = index - window[1]
+                window[2].extend(list(preceding)[len(preceding) - gap:] + [line])
+
+            window[1] = index + _lines_after
+
+        preceding.append(line)
+
+    if window is not None:
+        start, end, window_lines = window
+        yield start, min(end, index + 1), window_lines
+
+def _find_error_windows(lines):
+    return [(start, end) for start, end, window_lines in _iter_error_windows(lines)]
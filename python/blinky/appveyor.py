@@ -36,15 +36,22 @@ class AppVeyorAgent(HttpAgent):
         self.data_url = "https://ci.appveyor.com"
 
 class AppVeyorJob(HttpJob):
+    __slots__ = ("account", "project", "branch")
+
     def __init__(self, model, group, component, environment, agent, name, account, project, branch):
-        super().__init__(model, group, component, environment, agent, name)
+        super().__init__(model, group, component, environment, agent, name, f"{account}/{project}/{branch}")
 
         self.account = account
         self.project = project
         self.branch = branch
 
-        self.html_url = f"{self.agent.html_url}/project/{self.account}/{self.project}"
-        self.data_url = f"{self.agent.html_url}/api/projects/{self.account}/{self.project}/branch/{self.branch}"
+    @property
+    def html_url(self):
+        return f"{self.agent.html_url}/project/{self.account}/{self.project}"
+
+    @property
+    def data_url(self):
+        return f"{self.agent.html_url}/api/projects/{self.account}/{self.project}/branch/{self.branch}"
 
     def convert_result(self, data):
         data = data["build"]
@@ -73,7 +80,7 @@ class AppVeyorJob(HttpJob):
         if tests > 0:
             tests_url = f"{self.html_url}/build/tests"
 
-        result = JobResult()
+        result = JobResult(self)
         result.number = data["buildNumber"]
         result.status = status
         result.start_time = start_time
@@ -0,0 +1,259 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import argparse as _argparse
+import datetime as _datetime
+import gc as _gc
+import gzip as _gzip
+import json as _json
+import os as _os
+import statistics as _statistics
+import tempfile as _tempfile
+import threading as _threading
+import time as _time
+import tracemalloc as _tracemalloc
+
+from .history import *
+from .jenkins import *
+from .model import *
+
+_day = 24 * 60 * 60 * 1000 # Milliseconds
+
+def _create_model(job_count):
+    model = Model()
+
+    category = Category(model, "Category", "category")
+    group = Group(model, category, "Group")
+    component = Component(model, "Component")
+    environment = Environment(model, "Environment")
+    agent = Agent(model, "Agent")
+
+    for i in range(job_count):
+        Job(model, group, component, environment, agent, f"job-{i}", f"job-{i}")
+
+    return model
+
+def _create_result(number, start_time):
+    result = JobResult()
+    result.number = number
+    result.status = FAILED if number % 7 == 0 else PASSED
+    result.start_time = start_time
+    result.duration = 10 * 60 * 1000
+    result.html_url = f"https://ci.example.net/job/{number}"
+    result.data_url = f"https://ci.example.net/job/{number}/api/json"
+
+    return result
+
+def _time_median(func, count):
+    times = list()
+
+    for i in range(count):
+        start = _time.perf_counter()
+        func()
+        times.append(_time.perf_counter() - start)
+
+    return _statistics.median(times)
+
+def benchmark_history(job_count=1000, days=365, results_per_day=8):
+    print(f"History: {job_count} jobs, {days} days, {results_per_day} results per job per day")
+
+    model = _create_model(job_count)
+    now = int(_time.time() * 1000)
+    start_time = now - days * _day
+    interval = _day // results_per_day
+
+    with _tempfile.TemporaryDirectory() as temp_dir:
+        store = HistoryStore(_os.path.join(temp_dir, "history.db"), max_age=days + 1, downsample_age=days + 1)
+        store.open()
+
+        start = _time.perf_counter()
+        number = 0
+
+        for number in range(days * results_per_day):
+            for job in model.jobs:
+                store.append(job, _create_result(number, start_time + number * interval))
+
+            # Flush once per simulated day to keep the setup short
+            if number % results_per_day == 0:
+                store.flush()
+
+        store.flush()
+
+        elapsed = _time.perf_counter() - start
+        rows = job_count * days * results_per_day
+
+        print(f"  Populate:            {rows} results in {elapsed:.1f}s ({rows / elapsed:.0f}/s)")
+
+        def append_cycle():
+            nonlocal number
+            number += 1
+
+            for job in model.jobs:
+                store.append(job, _create_result(number, now))
+
+            store.flush()
+
+        print(f"  Append cycle:        {_time_median(append_cycle, 20) * 1000:.1f}ms per {job_count} results")
+
+        job = model.jobs[job_count // 2]
+        read = lambda: store.read(job, start_time=now - 30 * _day, end_time=now)
+
+        print(f"  Range read:          {_time_median(read, 100) * 1000:.2f}ms for 30 days of one job "
+              f"({len(read())} results)")
+
+        start = _time.perf_counter()
+        store.load(model)
+
+        print(f"  Load latest results: {(_time.perf_counter() - start) * 1000:.0f}ms for all jobs")
+        print(f"  File size:           {_file_size(store.path) / 1024 / 1024:.1f}MB")
+
+        store.downsample_age = 30
+
+        start = _time.perf_counter()
+        prune_thread = _threading.Thread(target=store.prune, args=(now,))
+        prune_thread.start()
+
+        # Pruning runs on its own thread and shouldn't hold up appends
+        append_times = list()
+
+        while prune_thread.is_alive():
+            append_start = _time.perf_counter()
+            append_cycle()
+            append_times.append(_time.perf_counter() - append_start)
+
+        prune_thread.join()
+
+        print(f"  Downsample:          {_time.perf_counter() - start:.1f}s to thin results older than 30 days")
+        print(f"  Append cycle during: {max(append_times) * 1000:.1f}ms at most, "
+              f"{_statistics.median(append_times) * 1000:.1f}ms median per {job_count} results")
+        print(f"  Append cycle after:  {_time_median(append_cycle, 20) * 1000:.1f}ms per {job_count} results")
+
+        store.close()
+
+# A model shaped like a real deployment, with several Jenkins agents
+# and categories, and two results per job
+def _create_fleet(job_count):
+    model = Model()
+
+    categories = [Category(model, f"Category {i}", f"category-{i}") for i in range(4)]
+    groups = [Group(model, categories[i % 4], f"Group {i}") for i in range(20)]
+    components = [Component(model, f"Component {i}") for i in range(50)]
+    environments = [Environment(model, f"Environment {i}") for i in range(10)]
+    agents = list()
+
+    for i in range(5):
+        agent = JenkinsAgent(model, f"Agent {i}", f"https://ci-{i}.example.net")
+        agent.update_time = _datetime.datetime.now(_datetime.timezone.utc)
+
+        agents.append(agent)
+
+    now = int(_time.time() * 1000)
+
+    for i in range(job_count):
+        job = JenkinsJob(model, groups[i % len(groups)], components[i % len(components)],
+                         environments[i % len(environments)], agents[i % len(agents)],
+                         f"job-{i}", f"folder-{i % 20}/job/job-{i}")
+
+        for number in (i + 100, i + 101):
+            job.update_data({
+                "number": number,
+                "result": "FAILURE" if number % 7 == 0 else "SUCCESS",
+                "timestamp": now - (i % 100) * 60 * 1000,
+                "duration": 10 * 60 * 1000,
+                "actions": [{"_class": "hudson.tasks.junit.TestResultAction"}],
+            })
+
+    model.update_time = _datetime.datetime.now(_datetime.timezone.utc)
+
+    return model
+
+def benchmark_data_format(job_counts=(100, 1000, 10000)):
+    print("Data format: the default format (v1) and the columnar format (v2)")
+
+    for job_count in job_counts:
+        model = _create_fleet(job_count)
+        json, digest, changes = model.render_json()
+        start = _time.perf_counter()
+        snapshot = Snapshot(json, digest, model.update_time, ())
+        publish_time = _time.perf_counter() - start
+
+        start = _time.perf_counter()
+        columnar_json = snapshot.columnar_json
+        snapshot.columnar_variants
+        columnar_time = _time.perf_counter() - start
+
+        print(f"  {job_count} jobs")
+
+        for name, content in (("v1", json), ("v2", columnar_json)):
+            size = len(content)
+            gzip_size = len(_gzip.compress(content, compresslevel=6, mtime=0))
+            parse_time = _time_median(lambda: _json.loads(content), 5)
+
+            print(f"    {name}: {size:>10} bytes, {gzip_size:>8} gzipped, "
+                  f"{parse_time * 1000:7.1f}ms to parse")
+
+        print(f"    Snapshot: {publish_time * 1000:.1f}ms to publish, "
+              f"{columnar_time * 1000:.1f}ms for the first v2 request")
+
+def benchmark_memory(job_count=10000):
+    print(f"Memory: {job_count} jobs with two results each")
+
+    _gc.collect()
+    _tracemalloc.start()
+
+    start_size = _tracemalloc.get_traced_memory()[0]
+
+    model = _create_fleet(job_count)
+    _gc.collect()
+
+    model_size = _tracemalloc.get_traced_memory()[0] - start_size
+
+    model.render_json()
+    _gc.collect()
+
+    rendered_size = _tracemalloc.get_traced_memory()[0] - start_size
+
+    _tracemalloc.stop()
+
+    print(f"  Model objects:       {model_size / job_count:.0f} bytes per job "
+          f"({model_size / 1024 / 1024:.1f}MB)")
+    print(f"  With rendered JSON:  {rendered_size / job_count:.0f} bytes per job "
+          f"({rendered_size / 1024 / 1024:.1f}MB)")
+
+def _file_size(path):
+    return sum(_os.path.getsize(x) for x in (path, path + "-wal") if _os.path.exists(x))
+
+_benchmarks = {
+    "history": benchmark_history,
+    "data-format": benchmark_data_format,
+    "memory": benchmark_memory,
+}
+
+def main():
+    parser = _argparse.ArgumentParser(description="Run Blinky performance benchmarks")
+    parser.add_argument("name", nargs="?", choices=["all"] + list(_benchmarks), default="all")
+
+    args = parser.parse_args()
+
+    for name, benchmark in _benchmarks.items():
+        if args.name in ("all", name):
+            benchmark()
+
+if __name__ == "__main__":
+    main()
@@ -36,14 +36,21 @@ class CircleAgent(HttpAgent):
         self.data_url = "https://circleci.com"
 
 class CircleJob(HttpJob):
+    __slots__ = ("repo", "branch")
+
     def __init__(self, model, group, component, environment, agent, name, repo, branch):
-        super().__init__(model, group, component, environment, agent, name)
+        super().__init__(model, group, component, environment, agent, name, f"{repo}/{branch}")
 
         self.repo = repo
         self.branch = branch
 
-        self.html_url = f"{self.agent.html_url}/{self.repo}/tree/{self.branch}"
-        self.data_url = f"{self.agent.data_url}/api/v1.1/project/{self.repo}/tree/{self.branch}?limit=1&shallow=1"
+    @property
+    def html_url(self):
+        return f"{self.agent.html_url}/{self.repo}/tree/{self.branch}"
+
+    @property
+    def data_url(self):
+        return f"{self.agent.data_url}/api/v1.1/project/{self.repo}/tree/{self.branch}?limit=1&shallow=1"
 
     def convert_result(self, data):
         data = data[0]
@@ -67,7 +74,7 @@ class CircleJob(HttpJob):
         html_url = data["build_url"]
         data_url = f"{self.agent.data_url}/api/v1.1/project/{self.repo}/{number}?limit=1&shallow=1"
 
-        result = JobResult()
+        result = JobResult(self)
         result.number = number
         result.status = status
         result.start_time = start_time
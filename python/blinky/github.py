@@ -19,6 +19,7 @@
 
 from .model import *
 
+import collections as _collections
 import logging as _logging
 import urllib.parse as _parse
 
@@ -30,29 +31,101 @@ _status_mapping = {
 }
 
 class GitHubAgent(HttpAgent):
-    def __init__(self, model, name, token=None):
+    def __init__(self, model, name, token=None, tokens=()):
         super().__init__(model, name)
 
         self.html_url = "https://github.com"
         self.data_url = "https://api.github.com"
         self.token = token
+        self.tokens = list(tokens)
+
+        self._jobs_by_branch = None
+
+    # One listing of recent runs per repo and branch, in place of one
+    # listing per workflow.  The listing is newest first, so the first
+    # run of each workflow is its latest.
+    def plan_fetches(self, jobs):
+        jobs_by_branch = _collections.defaultdict(list)
+
+        for job in jobs:
+            jobs_by_branch[(job.repo, job.branch)].append(job)
+
+        fetches = list()
+
+        for (repo, branch), branch_jobs in jobs_by_branch.items():
+            if len(branch_jobs) < 2:
+                continue
+
+            # The listing holds the runs of every workflow on the
+            # branch, so the page is sized for all of them, due or not
+            peers = self.get_bulk_peers(branch_jobs[0])
+
+            query = _parse.urlencode({
+                "branch": branch,
+                "per_page": min(_max_page_size, _runs_per_workflow * len(peers)),
+            })
+
+            fetches.append(BulkFetch(f"{self.data_url}/repos/{repo}/actions/runs?{query}", branch_jobs))
+
+        return fetches
+
+    # The listing covers every job on the same repo and branch
+    def get_bulk_peers(self, job):
+        if self._jobs_by_branch is None:
+            jobs_by_branch = _collections.defaultdict(list)
+
+            for job_ in self.jobs:
+                jobs_by_branch[(job_.repo, job_.branch)].append(job_)
+
+            self._jobs_by_branch = dict(jobs_by_branch)
+
+        return self._jobs_by_branch.get((job.repo, job.branch), (job,))
+
+    def distribute_data(self, fetch, data):
+        latest_runs = dict()
+
+        for run in data["workflow_runs"]:
+            latest_runs.setdefault(run["workflow_id"], run)
+
+        jobs_data = dict()
+
+        for job in fetch.jobs:
+            run = latest_runs.get(job.workflow_id)
+
+            # Workflows that haven't run lately fall back to their
+            # own fetch
+            if run is not None:
+                jobs_data[job] = {"workflow_runs": [run]}
+
+        return jobs_data
 
 class GitHubJob(HttpJob):
+    __slots__ = ("repo", "branch", "workflow_name", "workflow_id")
+
     def __init__(self, model, group, component, environment, agent, name, repo, branch, workflow_name, workflow_id):
-        super().__init__(model, group, component, environment, agent, name)
+        super().__init__(model, group, component, environment, agent, name, f"{repo}/{branch}/{workflow_id}")
 
         self.repo = repo
         self.branch = branch
         self.workflow_name = workflow_name
         self.workflow_id = workflow_id
 
+    @property
+    def html_url(self):
         escaped_name = _parse.quote(self.workflow_name)
 
         if " " in self.workflow_name:
             escaped_name = f"\"{escaped_name}\""
 
-        self.html_url = f"{self.agent.html_url}/{self.repo}/actions?query=workflow%3A{escaped_name}"
-        self.data_url = f"{self.agent.data_url}/repos/{self.repo}/actions/workflows/{self.workflow_id}/runs?branch={self.branch}"
+        return f"{self.agent.html_url}/{self.repo}/actions?query=workflow%3A{escaped_name}"
+
+    @property
+    def data_url(self):
+        return f"{self.agent.data_url}/repos/{self.repo}/actions/workflows/{self.workflow_id}/runs?branch={self.branch}"
+
+    @property
+    def fetch_url(self):
+        return f"{self.data_url}&per_page=1"
 
     def convert_result(self, data):
         try:
@@ -72,7 +145,7 @@ class GitHubJob(HttpJob):
             end_time = parse_timestamp(data["updated_at"])
             duration = end_time - start_time
 
-        result = JobResult()
+        result = JobResult(self)
         result.number = data["run_number"]
         result.status = status
         result.start_time = start_time
@@ -81,3 +154,7 @@ class GitHubJob(HttpJob):
         result.data_url = data["url"]
 
         return result
+
+# Enough runs to find the latest of each workflow in most repos
+_runs_per_workflow = 5
+_max_page_size = 100
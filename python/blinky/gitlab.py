@@ -30,24 +30,33 @@ _status_mapping = {
 }
 
 class GitLabAgent(HttpAgent):
-    def __init__(self, model, name, base_url="gitlab.com", token=None):
+    auth_scheme = "Bearer"
+
+    def __init__(self, model, name, base_url="gitlab.com", token=None, tokens=()):
         super().__init__(model, name)
 
         self.html_url = f"https://{base_url}"
         self.data_url = f"https://{base_url}/api/v4"
         self.token = token
+        self.tokens = list(tokens)
 
 class GitLabJob(HttpJob):
+    __slots__ = ("repo", "branch")
+
     def __init__(self, model, group, component, environment, agent, name, repo, branch):
-        super().__init__(model, group, component, environment, agent, name)
+        super().__init__(model, group, component, environment, agent, name, f"{repo}/{branch}")
 
         self.repo = repo
         self.branch = branch
 
-        escaped_repo_name = _parse.quote(self.repo, safe="")
+    @property
+    def html_url(self):
+        return f"{self.agent.html_url}/{self.repo}/-/pipelines?ref={self.branch}"
 
-        self.html_url = f"{self.agent.html_url}/{self.repo}/-/pipelines?ref={self.branch}"
-        self.data_url = f"{self.agent.data_url}/projects/{escaped_repo_name}/pipelines/latest?ref={self.branch}"
+    @property
+    def data_url(self):
+        escaped_repo_name = _parse.quote(self.repo, safe="")
+        return f"{self.agent.data_url}/projects/{escaped_repo_name}/pipelines/latest?ref={self.branch}"
 
     def convert_result(self, data):
         timestamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
@@ -64,7 +73,7 @@ class GitLabJob(HttpJob):
             end_time = parse_timestamp(data["updated_at"], timestamp_format)
             duration = end_time - start_time
 
-        result = JobResult()
+        result = JobResult(self)
         result.number = data["iid"]
         result.status = status
         result.start_time = start_time
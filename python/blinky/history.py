@@ -0,0 +1,205 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import logging as _logging
+import os as _os
+import sqlite3 as _sqlite3
+import threading as _threading
+import time as _time
+
+from .model import JobResult as _JobResult
+
+_log = _logging.getLogger("blinky.history")
+
+_day = 24 * 60 * 60 * 1000 # Milliseconds
+
+_schema = """
+create table if not exists results (
+    job text not null,
+    number integer not null,
+    status text,
+    start_time integer,
+    duration integer,
+    html_url text,
+    data_url text,
+    tests_url text,
+    logs_url text,
+    primary key (job, number)
+) without rowid;
+
+create index if not exists results_start_time on results (job, start_time);
+"""
+
+_columns = "job, number, status, start_time, duration, html_url, data_url, tests_url, logs_url"
+
+# An append-only record of every distinct result of every job, kept
+# in SQLite.  Appends are buffered in memory and written in one
+# transaction per model update.
+#
+# Results older than downsample_age are thinned to the last result
+# per job per day, and results older than max_age are deleted.  The
+# pruning runs on its own thread and connection, one job at a time,
+# so it never holds up appends or the update cycle.
+class HistoryStore:
+    def __init__(self, path, max_age=365, downsample_age=30):
+        self.path = path
+        self.max_age = max_age                   # Days
+        self.downsample_age = downsample_age     # Days
+        self.prune_interval = 60 * 60            # Seconds
+
+        self.prune_thread = _HistoryPruneThread(self)
+
+        self._pending = list()
+        self._pending_lock = _threading.Lock()
+        self._lock = _threading.Lock()           # For the connection
+        self._conn = None
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.path)
+
+    def open(self):
+        _log.info("Opening {}".format(self))
+
+        dir = _os.path.dirname(self.path)
+
+        if dir:
+            _os.makedirs(dir, exist_ok=True)
+
+        self._conn = _sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("pragma journal_mode = wal")
+        self._conn.execute("pragma synchronous = normal")
+        self._conn.executescript(_schema)
+
+    def close(self):
+        self.flush()
+
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+
+    # Called from Job.update, possibly from many threads
+    def append(self, job, result):
+        row = (job.key, result.number, result.status, result.start_time, result.duration,
+               result.html_url, result.data_url, result.tests_url, result.logs_url)
+
+        with self._pending_lock:
+            self._pending.append(row)
+
+    def flush(self):
+        with self._pending_lock:
+            rows = self._pending
+            self._pending = list()
+
+        if rows:
+            with self._lock, self._conn:
+                self._conn.executemany(f"insert or replace into results ({_columns}) "
+                                       f"values (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def prune(self, now=None):
+        if now is None:
+            now = int(_time.time() * 1000)
+
+        max_start_time = now - self.max_age * _day
+        downsample_start_time = now - self.downsample_age * _day
+        deleted = 0
+        thinned = 0
+
+        conn = _sqlite3.connect(self.path)
+
+        try:
+            jobs = [x[0] for x in conn.execute("select distinct job from results")]
+
+            # One short transaction per job, so writes from the
+            # update cycle get in between
+            for job in jobs:
+                with conn:
+                    deleted += conn.execute("delete from results where job = ? and start_time < ?",
+                                            (job, max_start_time)).rowcount
+
+                    # Keep the highest numbered result per day
+                    thinned += conn.execute("""
+                        delete from results
+                        where job = :job and number in (
+                            select number from (
+                                select number, row_number() over (
+                                    partition by start_time / :day order by number desc) as rank
+                                from results
+                                where job = :job and start_time < :start_time)
+                            where rank > 1)
+                        """, {"job": job, "start_time": downsample_start_time, "day": _day}).rowcount
+        finally:
+            conn.close()
+
+        _log.info("Pruned {} expired and {} downsampled results".format(deleted, thinned))
+
+    # Results for the job, oldest first
+    def read(self, job, start_time=None, end_time=None, limit=None):
+        sql = f"select {_columns} from results where job = ?"
+        params = [job.key]
+
+        if start_time is not None:
+            sql += " and start_time >= ?"
+            params.append(start_time)
+
+        if end_time is not None:
+            sql += " and start_time < ?"
+            params.append(end_time)
+
+        sql += " order by number desc"
+
+        if limit is not None:
+            sql += " limit ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        return [_convert_row(job, x) for x in reversed(rows)]
+
+    # Restore each job's current and previous results
+    def load(self, model):
+        for job in model.jobs:
+            for result in self.read(job, limit=2):
+                job.add_result(result)
+
+class _HistoryPruneThread(_threading.Thread):
+    def __init__(self, store):
+        super().__init__()
+
+        self.store = store
+        self.name = "_HistoryPruneThread"
+        self.daemon = True
+
+    def run(self):
+        while True:
+            try:
+                self.store.prune()
+            except KeyboardInterrupt:
+                raise
+            except:
+                _log.exception("Failure pruning {}".format(self.store))
+
+            _time.sleep(self.store.prune_interval)
+
+def _convert_row(job, row):
+    result = _JobResult(job)
+    result.number, result.status, result.start_time, result.duration, \
+        result.html_url, result.data_url, result.tests_url, result.logs_url = row[1:]
+
+    return result
@@ -20,6 +20,7 @@
 from .model import *
 
 import logging as _logging
+import urllib.parse as _parse
 
 _log = _logging.getLogger("blinky.jenkins")
 
@@ -36,15 +37,57 @@ class JenkinsAgent(HttpAgent):
         self.html_url = url
         self.data_url = f"{self.html_url}/api/json"
 
+    # One request for the last builds of all the jobs on the server,
+    # descending into folders as deep as the configured jobs go
+    def plan_fetches(self, jobs):
+        if len(jobs) < 2:
+            return []
+
+        depth = max(len(x.path) for x in jobs)
+        url = f"{self.data_url}?tree={_render_tree(depth)}"
+
+        return [BulkFetch(url, jobs)]
+
+    # The bulk fetch covers every job on the server
+    def get_bulk_peers(self, job):
+        return self.jobs
+
+    def distribute_data(self, fetch, data):
+        builds = dict()
+        _collect_builds(data, (), builds)
+
+        jobs_data = dict()
+
+        for job in fetch.jobs:
+            build = builds.get(job.path)
+
+            if build is not None:
+                jobs_data[job] = build
+
+        return jobs_data
+
 class JenkinsJob(HttpJob):
+    __slots__ = ("slug", "path")
+
     def __init__(self, model, group, component, environment, agent, name, slug):
-        super().__init__(model, group, component, environment, agent, name)
+        super().__init__(model, group, component, environment, agent, name, slug)
 
         self.slug = slug
 
-        self.html_url = f"{self.agent.html_url}/job/{self.slug}"
-        self.data_url = f"{self.html_url}/api/json?{_rest_api_qs}"
-        self.fetch_url = f"{self.html_url}/lastBuild/api/json?{_rest_api_qs}"
+        # The job's names from the top-level folder down
+        self.path = tuple(_parse.unquote(x) for x in self.slug.split("/job/"))
+
+    @property
+    def html_url(self):
+        return f"{self.agent.html_url}/job/{self.slug}"
+
+    @property
+    def data_url(self):
+        return f"{self.html_url}/api/json?{_rest_api_qs}"
+
+    @property
+    def fetch_url(self):
+        return f"{self.html_url}/lastBuild/api/json?{_rest_api_qs}"
 
     def convert_result(self, data):
         number = data["number"]
@@ -62,7 +105,7 @@ class JenkinsJob(HttpJob):
                     tests_url = f"{html_url}/testReport"
                     break
 
-        result = JobResult()
+        result = JobResult(self)
         result.number = number
         result.status = status
         result.start_time = data["timestamp"]
@@ -75,4 +118,23 @@ class JenkinsJob(HttpJob):
         return result
 
 # Fetch only as much data as we need
-_rest_api_qs = "tree=number,result,actions,timestamp,duration"
+_build_tree = "number,result,actions[_class],timestamp,duration"
+_rest_api_qs = f"tree={_build_tree}"
+
+def _render_tree(depth):
+    tree = f"name,lastBuild[{_build_tree}]"
+
+    for i in range(depth - 1):
+        tree = f"name,lastBuild[{_build_tree}],jobs[{tree}]"
+
+    return f"jobs[{tree}]"
+
+def _collect_builds(data, path, builds):
+    for job_data in data.get("jobs") or ():
+        job_path = path + (job_data["name"],)
+        build = job_data.get("lastBuild")
+
+        if build is not None:
+            builds[job_path] = build
+
+        _collect_builds(job_data, job_path, builds)
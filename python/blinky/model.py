@@ -20,19 +20,40 @@
 import collections as _collections
 import concurrent.futures as _futures
 import datetime as _datetime
+import functools as _functools
+import gzip as _gzip
 import json as _json
 import hashlib as _hashlib
+import heapq as _heapq
 import logging as _logging
+import os as _os
+import random as _random
+import re as _re
 import requests as _requests
-import sched as _sched
 import threading as _threading
 import time as _time
 
+try:
+    import brotli as _brotli
+except ImportError:
+    _brotli = None
+
+from .transport import CircuitOpenError as _CircuitOpenError
+from .transport import HttpTransport as _HttpTransport
+from .transport import RateLimit as _RateLimit
+
 _log = _logging.getLogger("blinky.model")
 
 PASSED = "PASSED"
 FAILED = "FAILED"
 
+# Returned by fetch_data when the upstream data hasn't changed
+NOT_MODIFIED = object()
+
+# Returned by fetch_data when the fetch is put off to stay within a
+# rate limit
+DEFERRED = object()
+
 class Model:
     def __init__(self):
         self.title = "Blinky"
@@ -40,7 +61,14 @@ class Model:
         self.update_thread = _ModelUpdateThread(self)
         self.update_time = None
 
+        self.min_poll_interval = 30        # Seconds between updates of a busy job
+        self.max_poll_interval = 30 * 60   # Seconds between updates of an idle job
+        self.update_deadline = 60          # Seconds before an agent's update is logged as late
+
         self.executor = _futures.ThreadPoolExecutor()
+        self.transport = _HttpTransport()
+        self.history = None # An optional HistoryStore
+        self.state_file = None # An optional path for saving state across restarts
 
         self.categories = list()
         self.groups = list()
@@ -49,12 +77,44 @@ class Model:
         self.agents = list()
         self.jobs = list()
 
-        self.json = None
-        self.json_digest = None
+        # The published state.  It is replaced, never modified.
+        self.snapshot = None
+
+        # Recently published versions, for rendering deltas
+        self.versions = _collections.deque(maxlen=100)
+
+        # Functions called with the model after each update that
+        # changed the data
+        self.update_listeners = list()
+
+        # Functions called with the model after each agent update,
+        # whether or not it changed the data
+        self.check_listeners = list()
+        self.check_time = None # When the last agent update finished
+
+        self._running_agents = dict() # Update futures by agent
+        self._waiting_jobs = dict() # (Jobs, callback) by busy agent
+        self._running_agents_lock = _threading.Lock()
+        self._publish_lock = _threading.Lock()
+
+        # Changes rendered but not yet published, because nothing that
+        # counts toward the digest changed
+        self._unpublished_changes = dict()
 
     def __repr__(self):
         return _format_repr(self)
 
+    @property
+    def object_collections(self):
+        return {
+            "agents": self.agents,
+            "categories": self.categories,
+            "components": self.components,
+            "environments": self.environments,
+            "groups": self.groups,
+            "jobs": self.jobs,
+        }
+
     def render_data(self):
         if self.update_time is None:
             raise Exception("The model isn't updated yet")
@@ -91,30 +151,350 @@ class Model:
 
         return data
 
-    def update(self):
-        _log.info("Updating {}".format(self))
+    def render_json(self, update_time=None):
+        if update_time is None:
+            update_time = self.update_time
+
+        if update_time is None:
+            raise Exception("The model isn't updated yet")
+
+        # Assemble the document from the objects' cached fragments.
+        # The output matches json.dumps(self.render_data(),
+        # sort_keys=True), and the digest is computed over the
+        # fragments' digests, so only changed objects are rendered
+        # and hashed.  The update time is left out of the digest, so
+        # the digest changes only when the data does.
+        #
+        # Returns the JSON, its digest, and the fragments of the
+        # objects that changed since the last render.
+
+        fields = {
+            "title": _json.dumps(self.title),
+            "update_time": _json.dumps(int(round(update_time.timestamp() * 1000))),
+        }
+
+        digest = _hashlib.sha1()
+        digest.update(fields["title"].encode("utf-8"))
+
+        changes = dict(fields)
+
+        for name, objects in self.object_collections.items():
+            fragments = dict()
+            changed_fragments = dict()
+
+            for obj in objects:
+                json, rendered = obj.render_json()
+                fragments[obj.id] = json
+                digest.update(obj.json_digest)
+
+                if rendered:
+                    changed_fragments[obj.id] = json
+
+            fields[name] = _join_fragments(fragments)
+
+            if changed_fragments:
+                changes[name] = changed_fragments
+
+        json = _join_fragments(fields).encode("utf-8")
+
+        return json, digest.hexdigest(), changes
+
+    # Start updating the jobs and return.  Each agent's results are
+    # published as soon as they are in.  The callback, if any, is
+    # called with each agent's jobs when they are done.
+    def update(self, jobs=None, callback=None):
+        if jobs is None:
+            jobs = self.jobs
+
+        _log.info("Updating {} jobs".format(len(jobs)))
+
+        self.transport.evict_idle()
+
+        jobs_by_agent = _collections.defaultdict(list)
+        disabled_jobs = list()
+
+        for job in jobs:
+            if job.agent.enabled:
+                jobs_by_agent[job.agent].append(job)
+            else:
+                disabled_jobs.append(job)
+
+        futures = dict() # (Future, jobs) by agent
+
+        with self._running_agents_lock:
+            for agent, agent_jobs in jobs_by_agent.items():
+                # Jobs that come due while their agent is busy wait
+                # for it, and are updated as soon as it finishes
+                if agent in self._running_agents:
+                    _log.info("{} is still updating".format(agent))
+
+                    waiting_jobs, callback_ = self._waiting_jobs.setdefault(agent, (list(), callback))
+                    waiting_jobs.extend(agent_jobs)
+
+                    continue
 
-        futures = [self.executor.submit(x.update) for x in self.agents if x.enabled]
+                future = self.executor.submit(agent.update, agent_jobs)
+                self._running_agents[agent] = future
+                futures[agent] = future, agent_jobs
 
-        for future in _futures.as_completed(futures):
-            if future.exception() is not None:
-                _log.error("Failure updating: {}".format(future.exception()))
+        # The callbacks are added outside the lock, because a callback
+        # for a future that is already done runs right away, and it
+        # takes the lock
+        start_time = _time.monotonic()
 
-        self.update_time = _datetime.datetime.now(_datetime.timezone.utc)
+        for agent, (future, agent_jobs) in futures.items():
+            future.add_done_callback(_functools.partial(self._agent_updated, agent, agent_jobs, callback,
+                                                        start_time))
 
-        data = self.render_data()
+        if disabled_jobs and callback is not None:
+            callback(disabled_jobs)
 
-        prev_json = self.json or ""
-        prev_digest = self.json_digest or "-"
+        # Nothing was updated, but there must be something to serve
+        if not futures and self.snapshot is None:
+            self.publish()
 
-        self.json = _json.dumps(data, sort_keys=True).encode("utf-8")
-        self.json_digest = _hashlib.sha1(self.json).hexdigest()
+    def _agent_updated(self, agent, jobs, callback, start_time, future):
+        with self._running_agents_lock:
+            del self._running_agents[agent]
+            waiting = self._waiting_jobs.pop(agent, None)
 
-        _log.debug("Prev json: {} {}".format(prev_digest, len(prev_json)))
-        _log.debug("Curr json: {} {}".format(self.json_digest, len(self.json)))
+        if future.exception() is not None:
+            _log.error("Failure updating {}: {}".format(agent, future.exception()))
+
+        elapsed = _time.monotonic() - start_time
+
+        if elapsed > self.update_deadline:
+            _log.warn("{} missed the update deadline ({:.0f}s)".format(agent, elapsed))
+
+        agent.update_time = _datetime.datetime.now(_datetime.timezone.utc)
+        agent.dirty = True
+
+        try:
+            self.publish()
+        except:
+            _log.exception("Failure publishing")
+
+        if callback is not None:
+            try:
+                callback(jobs)
+            except:
+                _log.exception("Failure calling {}".format(callback))
+
+        if waiting is not None:
+            try:
+                self.update(*waiting)
+            except:
+                _log.exception("Failure updating {}".format(agent))
+
+    def publish(self):
+        with self._publish_lock:
+            self._publish()
+
+    # Publish a new snapshot if the data changed.  Otherwise, clients
+    # aren't notified, and the state isn't saved.
+    def _publish(self):
+        update_time = _datetime.datetime.now(_datetime.timezone.utc)
+
+        if self.history is not None:
+            try:
+                self.history.flush()
+            except:
+                _log.exception("Failure recording history")
+
+        json, digest, changes = self.render_json(update_time)
+        _merge_changes(self._unpublished_changes, changes)
+
+        self.check_time = update_time
+
+        if self.snapshot is not None and digest == self.snapshot.digest:
+            _log.debug("Unchanged: {}".format(digest))
+            self._notify(self.check_listeners)
+            return
+
+        self.update_time = update_time
+        self.versions.append((digest, self._unpublished_changes))
+        self._unpublished_changes = dict()
+
+        # Readers see the old snapshot or the new one, never a mix
+        self.snapshot = Snapshot(json, digest, self.update_time, tuple(self.versions))
+
+        _log.debug("Published: {} {}".format(digest, len(json)))
+        _log.debug("Transport: {}".format(self.transport.stats()))
+
+        if self.state_file is not None:
+            try:
+                self.save_state()
+            except:
+                _log.exception("Failure saving state to {}".format(self.state_file))
 
         _log.info("Updated at {}".format(self.update_time))
 
+        self._notify(self.update_listeners)
+        self._notify(self.check_listeners)
+
+    def _notify(self, listeners):
+        for listener in listeners:
+            try:
+                listener(self)
+            except:
+                _log.exception("Failure notifying {}".format(listener))
+
+    # The times of the last updates, apart from the data.  The data
+    # isn't republished when an update changes nothing, so these are
+    # what show that polling is still going on.
+    def render_check_data(self):
+        agents_data = dict()
+
+        for agent in self.agents:
+            if agent.update_time is not None:
+                agents_data[agent.id] = int(round(agent.update_time.timestamp() * 1000))
+
+        return {
+            "version": self.snapshot.digest,
+            "update_time": int(round(self.check_time.timestamp() * 1000)),
+            "agents": agents_data,
+        }
+
+    # Write the job state to the state file.  The file is replaced
+    # atomically, so a crash leaves the previous state in place.
+    def save_state(self):
+        state = {
+            "update_time": self.snapshot.update_time.timestamp(),
+            "jobs": {x.key: x.save_state() for x in self.jobs},
+        }
+
+        temp_file = f"{self.state_file}.tmp"
+
+        with open(temp_file, "w") as f:
+            _json.dump(state, f)
+            f.flush()
+            _os.fsync(f.fileno())
+
+        _os.replace(temp_file, self.state_file)
+
+    # Restore the state saved by a previous process, so the data is
+    # served right away while the first update runs.  Saved jobs that
+    # are no longer configured are ignored.
+    def load_state(self):
+        if not _os.path.exists(self.state_file):
+            return
+
+        _log.info("Loading state from {}".format(self.state_file))
+
+        with open(self.state_file) as f:
+            state = _json.load(f)
+
+        jobs_state = state["jobs"]
+        loaded = 0
+
+        for job in self.jobs:
+            job_state = jobs_state.get(job.key)
+
+            if job_state is None:
+                continue
+
+            job.load_state(job_state)
+            loaded += 1
+
+        self.update_time = _datetime.datetime.fromtimestamp(state["update_time"], _datetime.timezone.utc)
+        json, digest, changes = self.render_json()
+
+        self.versions.append((digest, changes))
+        self.snapshot = Snapshot(json, digest, self.update_time, tuple(self.versions))
+
+        _log.info("Loaded the state of {} of {} jobs".format(loaded, len(self.jobs)))
+
+# The published state of the model: the JSON data, its digest, and
+# the recent versions for rendering deltas.  The compressed variants,
+# the columnar data, and the full delta are made from it on first
+# use, once per snapshot, so publishing stays cheap and the cost
+# doesn't grow with the number of clients.
+#
+# A snapshot's data is never modified after it is created.  The model
+# publishes a new one by replacing its reference, so readers on other
+# threads always get a body that matches its digest.
+class Snapshot:
+    def __init__(self, json, digest, update_time, versions):
+        self.json = json                # Bytes
+        self.digest = digest
+        self.update_time = update_time
+        self.versions = versions        # A tuple of (digest, changes), oldest first
+
+        self._derived = dict()          # Values made on first use, by name
+        self._lock = _threading.RLock() # Some values are made from others
+
+    # Compressed JSON bytes by content encoding
+    @property
+    def variants(self):
+        return self._get_derived("variants", lambda: _compress(self.json))
+
+    @property
+    def columnar_json(self):
+        return self._get_derived("columnar_json", self._render_columnar)
+
+    @property
+    def columnar_variants(self):
+        return self._get_derived("columnar_variants", lambda: _compress(self.columnar_json))
+
+    # The delta for clients with no usable version is the same for all
+    # of them
+    @property
+    def full_delta(self):
+        return self._get_derived("full_delta",
+                                 lambda: _render_delta(self.json.decode("utf-8"), self.digest, True))
+
+    @property
+    def full_delta_variants(self):
+        return self._get_derived("full_delta_variants", lambda: _compress(self.full_delta))
+
+    def _get_derived(self, name, make):
+        try:
+            return self._derived[name]
+        except KeyError:
+            pass
+
+        # Concurrent requests for the same value wait for one thread
+        # to make it
+        with self._lock:
+            try:
+                return self._derived[name]
+            except KeyError:
+                value = self._derived[name] = make()
+                return value
+
+    def _render_columnar(self):
+        columnar_data = _convert_columnar(_json.loads(self.json))
+        return _json.dumps(columnar_data, separators=(",", ":")).encode("utf-8")
+
+    def __repr__(self):
+        return _format_repr(self, self.digest)
+
+    def is_delta_full(self, since):
+        return since not in (x[0] for x in self.versions)
+
+    # Render the changes published after version 'since'.  If that
+    # version is unknown, render everything.
+    def render_delta(self, since=None):
+        versions = self.versions
+        digests = [x[0] for x in versions]
+
+        if since not in digests:
+            return self.full_delta
+
+        merged = dict()
+
+        for digest, changes in versions[digests.index(since) + 1:]:
+            _merge_changes(merged, changes)
+
+        for name, value in merged.items():
+            if isinstance(value, dict):
+                merged[name] = _join_fragments(value)
+
+        return _render_delta(_join_fragments(merged), versions[-1][0], False)
+
+# Each job is scheduled on its own.  Busy jobs are updated often, and
+# idle jobs back off.  Jobs that come due at about the same time are
+# updated together, along with any jobs that share their bulk fetch.
 class _ModelUpdateThread(_threading.Thread):
     def __init__(self, model):
         super().__init__()
@@ -123,7 +503,16 @@ class _ModelUpdateThread(_threading.Thread):
         self.name = "_ModelUpdateThread"
         self.daemon = True
 
-        self.scheduler = _sched.scheduler()
+        self.queue = list() # A heap of (due time, job ID)
+        self.batch_window = 5 # Seconds
+
+        # The IDs of the jobs being updated.  Every job is either in
+        # the queue or here.
+        self.updating = set()
+
+        # The thread waits on it for the next due job.  The agents'
+        # update threads notify it when they requeue their jobs.
+        self._condition = _threading.Condition()
 
     def start(self):
         _log.info("Starting update thread")
@@ -131,20 +520,83 @@ class _ModelUpdateThread(_threading.Thread):
         super().start()
 
     def run(self):
-        self.update_model()
-        self.scheduler.run()
+        with self._condition:
+            self.updating.update(x.id for x in self.model.jobs)
+
+        self.update_jobs(self.model.jobs)
+
+        while True:
+            self.update_due_jobs()
+
+    def update_due_jobs(self):
+        with self._condition:
+            while True:
+                now = _time.monotonic()
+
+                if self.queue and self.queue[0][0] <= now:
+                    break
+
+                self._condition.wait(self.queue[0][0] - now if self.queue else None)
+
+            horizon = now + self.batch_window
+            jobs = dict()
+            count = 0
+
+            while self.queue and self.queue[0][0] <= horizon:
+                due_time, job_id = _heapq.heappop(self.queue)
+                job = self.model.jobs[job_id]
+                count += 1
 
-    def update_model(self):
-        self.scheduler.enter(20 * 60, 1, self.update_model)
+                # A job that shares a bulk fetch brings its peers
+                # along, so one response updates all of them, not
+                # just the few that happened to come due
+                for peer in job.agent.get_bulk_peers(job):
+                    if peer.id not in self.updating:
+                        jobs[peer.id] = peer
 
+            # Peers not yet due come out of the queue.  They go back
+            # in after the update, like the rest.
+            if len(jobs) > count:
+                self.queue = [x for x in self.queue if x[1] not in jobs]
+                _heapq.heapify(self.queue)
+
+            self.updating.update(jobs)
+
+        self.update_jobs(list(jobs.values()))
+
+    # Updates run in the background.  The scheduler moves on to the
+    # next due jobs, and each agent's jobs are requeued when they are
+    # done.
+    def update_jobs(self, jobs):
         try:
-            self.model.update()
+            self.model.update(jobs, self.requeue_jobs)
         except KeyboardInterrupt:
             raise
         except:
             _log.exception("Update failed")
+            self.requeue_jobs(jobs)
+
+    def requeue_jobs(self, jobs):
+        now = _time.monotonic()
+
+        with self._condition:
+            for job in jobs:
+                if job.id in self.updating:
+                    self.updating.remove(job.id)
+                    _heapq.heappush(self.queue, (now + job.get_poll_interval(), job.id))
 
+            self._condition.notify()
+
+# Model objects use slots, so a model with many thousands of jobs
+# stays small.  Agents are few, and their subclasses aren't slotted.
 class _ModelObject:
+    __slots__ = ("model", "id", "name", "dirty", "json", "json_digest")
+
+    # Rendered fields that change with every update, whether or not
+    # anything of note happened.  They are left out of the digest, so
+    # they alone don't make a new version.
+    volatile_fields = ()
+
     def __init__(self, model, collection, name):
         assert isinstance(model, Model), model
         assert isinstance(collection, list), collection
@@ -154,11 +606,39 @@ class _ModelObject:
         self.id = len(collection)
         self.name = name
 
+        # The cached rendered fragment and the digest of its stable
+        # fields.  Set dirty when the rendered state changes.
+        self.dirty = True
+        self.json = None
+        self.json_digest = None
+
         collection.append(self)
 
     def __repr__(self):
         return _format_repr(self, self.id, self.name)
 
+    # Returns the fragment and whether it was rendered anew.  The
+    # object may be marked dirty again while this runs, so callers
+    # go by the result, not by a separate look at dirty.
+    def render_json(self):
+        rendered = self.dirty
+
+        if rendered:
+            self.dirty = False
+
+            data = self.render_data()
+            self.json = stable_json = _json.dumps(data, sort_keys=True)
+
+            if self.volatile_fields:
+                for name in self.volatile_fields:
+                    data.pop(name, None)
+
+                stable_json = _json.dumps(data, sort_keys=True)
+
+            self.json_digest = _hashlib.sha1(stable_json.encode("utf-8")).digest()
+
+        return self.json, rendered
+
     def render_data(self):
         data = dict()
         data["id"] = self.id
@@ -170,6 +650,8 @@ class _ModelObject:
         return data
 
 class Category(_ModelObject):
+    __slots__ = ("key", "groups")
+
     def __init__(self, model, name, key):
         super().__init__(model, model.categories, name)
 
@@ -187,6 +669,8 @@ class Category(_ModelObject):
         return data
 
 class Group(_ModelObject):
+    __slots__ = ("category", "jobs")
+
     def __init__(self, model, category, name):
         super().__init__(model, model.groups, name)
 
@@ -205,18 +689,24 @@ class Group(_ModelObject):
         return data
 
 class Component(_ModelObject):
+    __slots__ = ("jobs",)
+
     def __init__(self, model, name):
         super().__init__(model, model.components, name)
 
         self.jobs = list()
 
 class Environment(_ModelObject):
+    __slots__ = ("jobs",)
+
     def __init__(self, model, name):
         super().__init__(model, model.environments, name)
 
         self.jobs = list()
 
 class Agent(_ModelObject):
+    volatile_fields = ("update_time", "rate_limits", "circuit_breakers")
+
     def __init__(self, model, name):
         super().__init__(model, model.agents, name)
 
@@ -224,71 +714,154 @@ class Agent(_ModelObject):
         self.data_url = None
         self.token = None
         self.enabled = True
+        self.update_time = None # When its last update finished
 
         self.jobs = list()
+        self.job_keys = set()
 
-    def update(self):
+    def update(self, jobs):
         raise NotImplementedError()
 
+    # The jobs updated by the same bulk fetch as the given job.  They
+    # are scheduled together.
+    def get_bulk_peers(self, job):
+        return (job,)
+
     def render_data(self):
         data = super().render_data()
         data["html_url"] = self.html_url
         data["data_url"] = self.data_url
+        data["update_time"] = None
+
+        if self.update_time is not None:
+            data["update_time"] = int(round(self.update_time.timestamp() * 1000))
 
         return data
 
 class Job(_ModelObject):
-    def __init__(self, model, group, component, environment, agent, name):
+    __slots__ = ("group", "component", "environment", "agent", "key", "current_result", "previous_result",
+                 "update_failures", "unchanged_updates")
+
+    # A job's URLs aren't stored.  Subclasses derive them on access
+    # from the agent's URLs and the job's own fields.
+    html_url = None
+    data_url = None
+    fetch_url = None
+
+    # The key identifies the job within its agent.  It is made from
+    # the job's own fields, not its name, which is often None.  Job
+    # state and history are stored under the agent name and the key.
+    def __init__(self, model, group, component, environment, agent, name, key):
         super().__init__(model, model.jobs, name)
 
         assert isinstance(group, Group), group
         assert isinstance(component, Component), component
         assert isinstance(environment, Environment), environment
         assert isinstance(agent, Agent), agent
+        assert isinstance(key, str), key
+        assert key not in agent.job_keys, f"Job key {key} is already used by agent {agent.name}"
 
         self.group = group
         self.component = component
         self.environment = environment
         self.agent = agent
+        self.key = f"{agent.name}/{key}"
+
+        self.agent.job_keys.add(key)
 
         self.group.jobs.append(self)
         self.component.jobs.append(self)
         self.environment.jobs.append(self)
         self.agent.jobs.append(self)
 
-        self.results = _collections.deque(maxlen=2)
+        self.current_result = None
+        self.previous_result = None
         self.update_failures = 0
-
-        self.html_url = None
-        self.data_url = None
-        self.fetch_url = None
+        self.unchanged_updates = 0
 
     def update(self, context):
-        data = self.fetch_data(context)
+        self.update_data(self.fetch_data(context))
+
+    # Apply fetched data.  It is None if the fetch failed.
+    def update_data(self, data):
+        if data is DEFERRED:
+            return
 
         if data is None:
             self.update_failures += 1
+            self.dirty = True
             return
 
-        try:
-            result = self.convert_result(data)
-        except KeyboardInterrupt:
-            raise
-        except:
-            self.update_failures += 1
+        if data is not NOT_MODIFIED:
+            try:
+                result = self.convert_result(data)
+            except KeyboardInterrupt:
+                raise
+            except:
+                self.update_failures += 1
+                self.dirty = True
 
-            _log.exception("Failure converting {}".format(self))
+                _log.exception("Failure converting {}".format(self))
 
+                return
+
+            assert result is not None
+
+        if self.update_failures > 0:
+            self.update_failures = 0
+            self.dirty = True
+
+        if data is NOT_MODIFIED:
+            self.unchanged_updates += 1
             return
 
-        assert result is not None
+        if self.current_result and self.current_result.render_data() == result.render_data():
+            self.unchanged_updates += 1
+            return
 
-        self.update_failures = 0
+        self.unchanged_updates = 0
 
-        if self.current_result and self.current_result.number == result.number:
-            self.results[-1] = result
-        else:
-            self.results.append(result)
+        self.add_result(result)
+
+        # After the change, in case it's being rendered on another
+        # thread
+        self.dirty = True
+
+        if self.model.history is not None:
+            self.model.history.append(self, result)
+
+    def add_result(self, result):
+        if self.current_result is None or self.current_result.number != result.number:
+            self.previous_result = self.current_result
+
+        self.current_result = result
+
+    def get_poll_interval(self):
+        result = self.current_result
+        exponent = self.unchanged_updates
+
+        if self.update_failures > 0:
+            exponent = self.update_failures
+        elif result is None or self.is_running():
+            exponent = 0
+
+        interval = self.model.min_poll_interval * 2 ** min(exponent, 16)
+        interval = min(interval, self.model.max_poll_interval)
+
+        # Jitter keeps jobs from bunching up
+        return interval * _random.uniform(1, 1.25)
+
+    def is_running(self):
+        result = self.current_result
+
+        if result is None or result.duration is not None or result.start_time is None:
+            return False
+
+        # Some agents never report a duration.  Don't poll them
+        # rapidly forever.
+        age = _time.time() * 1000 - result.start_time
+
+        return age < _max_run_time
 
     def fetch_data(self, context):
         raise NotImplementedError()
@@ -296,15 +869,33 @@ class Job(_ModelObject):
     def convert_result(self, data):
         raise NotImplementedError()
 
-    @property
-    def current_result(self):
-        if len(self.results) >= 1:
-            return self.results[-1]
+    def save_state(self):
+        return {
+            "results": [x.render_data() for x in self.results],
+            "update_failures": self.update_failures,
+            "unchanged_updates": self.unchanged_updates,
+        }
+
+    def load_state(self, state):
+        self.current_result = None
+        self.previous_result = None
+
+        for result_data in state["results"]:
+            result = JobResult(self)
+
+            for name, value in result_data.items():
+                setattr(result, name, value)
+
+            self.add_result(result)
 
+        self.update_failures = state["update_failures"]
+        self.unchanged_updates = state["unchanged_updates"]
+        self.dirty = True
+
+    # The current and previous results, oldest first
     @property
-    def previous_result(self):
-        if len(self.results) >= 2:
-            return self.results[-2]
+    def results(self):
+        return tuple(x for x in (self.previous_result, self.current_result) if x is not None)
 
     def render_data(self):
         data = super().render_data()
@@ -329,16 +920,56 @@ class Job(_ModelObject):
 
         return data
 
+# A URL attribute of a job result.  A URL under the job's URL is
+# stored as the part after it, and the whole URL is derived again on
+# access.  Since the job's URL is derived from its agent's URL, such
+# result URLs cost only their short suffix.
+class _ResultUrl:
+    def __set_name__(self, owner, name):
+        self.slot = "_" + name
+
+    def __get__(self, result, owner=None):
+        if result is None:
+            return self
+
+        url = getattr(result, self.slot)
+
+        # Whole URLs never start with a slash
+        if url is not None and url.startswith("/"):
+            return result.job.html_url + url
+
+        return url
+
+    def __set__(self, result, url):
+        job_url = None
+
+        if result.job is not None:
+            job_url = result.job.html_url
+
+        if url is not None and job_url and url.startswith(job_url + "/"):
+            url = url[len(job_url):]
+
+        setattr(result, self.slot, url)
+
 class JobResult:
-    def __init__(self):
+    __slots__ = ("job", "number", "status", "start_time", "duration",
+                 "_html_url", "_data_url", "_tests_url", "_logs_url")
+
+    html_url = _ResultUrl()     # World Wide Web URL
+    data_url = _ResultUrl()     # Usually a JSON URL
+    tests_url = _ResultUrl()    # Test results
+    logs_url = _ResultUrl()     # Log output
+
+    def __init__(self, job=None):
+        self.job = job          # The job the result belongs to, if known
         self.number = None      # Result sequence number
         self.status = None      # Status string (PASSED, FAILED, [other])
         self.start_time = None  # Start time in milliseconds
         self.duration = None    # Duration in milliseconds
-        self.html_url = None    # World Wide Web URL
-        self.data_url = None    # Usually a JSON URL
-        self.tests_url = None   # Test results
-        self.logs_url = None    # Log output
+        self.html_url = None
+        self.data_url = None
+        self.tests_url = None
+        self.logs_url = None
 
     def render_data(self):
         data = dict()
@@ -355,43 +986,204 @@ class JobResult:
         return data
 
 class HttpAgent(Agent):
-    def update(self):
+    auth_scheme = "token" # For the Authorization header
+
+    def __init__(self, model, name):
+        super().__init__(model, name)
+
+        self.max_concurrency = 16 # Concurrent job fetches
+        self.bulk_validators = dict() # (Conditional request headers, jobs updated) by URL
+
+        # A pool of API tokens, used in place of token.  Requests go
+        # to the token with the most remaining budget.
+        self.tokens = list()
+
+        self.rate_limits = dict() # By token
+        self._rate_limits_lock = _threading.Lock()
+
+        self.hosts = set() # The keys of the hosts this agent has used
+
+    def update(self, jobs):
         start = _time.time()
 
-        with _requests.Session() as session:
-            for job in self.jobs:
-                job.update(session)
+        self.update_jobs(jobs)
 
         elapsed = _time.time() - start
 
-        _log.info("{} updated {} jobs in {:.2f}s".format(self, len(self.jobs), elapsed))
+        _log.info("{} updated {} jobs in {:.2f}s".format(self, len(jobs), elapsed))
 
-class HttpJob(Job):
-    def fetch_data(self, session, headers={}):
-        if self.agent.token:
-            headers["Authorization"] = f"token {self.agent.token}"
+        rate_limits = [self.get_rate_limit(x) for x in self.get_tokens()]
 
-        url = self.data_url
+        if any(x.limit is not None for x in rate_limits):
+            _log.debug("{} rate limits: {}".format(self, rate_limits))
 
-        if self.fetch_url is not None:
-            url = self.fetch_url
+        # The rate limits and circuit breakers change as we go
+        self.dirty = True
+
+    def render_data(self):
+        data = super().render_data()
+        data["rate_limits"] = [self.get_rate_limit(x).render_data() for x in self.get_tokens()]
+
+        breakers = data["circuit_breakers"] = dict()
+
+        for key in sorted(self.hosts):
+            breaker = self.model.transport.get_breaker(key)
+
+            if breaker is not None:
+                breakers[key] = breaker.render_data()
+
+        return data
+
+    def get_tokens(self):
+        if self.tokens:
+            return self.tokens
+
+        return [self.token]
+
+    def get_rate_limit(self, token):
+        with self._rate_limits_lock:
+            try:
+                return self.rate_limits[token]
+            except KeyError:
+                rate_limit = self.rate_limits[token] = _RateLimit()
+                return rate_limit
+
+    # Returns a token and its rate limit, or None if every token's
+    # budget is spent for now.  Tokens whose limit is exhausted stay
+    # parked until it resets.
+    def acquire_token(self):
+        rate_limits = [(x, self.get_rate_limit(x)) for x in self.get_tokens()]
+        rate_limits.sort(key=lambda x: x[1].get_budget(), reverse=True)
+
+        for token, rate_limit in rate_limits:
+            if rate_limit.acquire():
+                return token, rate_limit
+
+    def update_jobs(self, jobs):
+        # The fetches use Requests, so they run on a thread pool sized
+        # to the concurrency cap.  They share the model's transport,
+        # which keeps connections alive across jobs and across update
+        # cycles.
+
+        transport = self.model.transport
+
+        with _futures.ThreadPoolExecutor(self.max_concurrency, "fetch") as executor:
+            fetches = self.plan_fetches(jobs)
+            updated_jobs = set()
+
+            for jobs_ in executor.map(lambda x: self.update_bulk(x, transport), fetches):
+                updated_jobs.update(jobs_)
+
+            # The rest are fetched one by one.  The least recently
+            # fetched go first, so jobs put off by the rate limit get
+            # their turn.
+            jobs = sorted((x for x in jobs if x not in updated_jobs), key=lambda x: x.fetch_time)
+
+            for _ in executor.map(lambda x: x.update(transport), jobs):
+                pass
+
+    # Agents for services that can report on many jobs in one request
+    # override plan_fetches and distribute_data.  Jobs not covered by
+    # a bulk fetch, or missing from its data, fall back to their own
+    # fetches.
+
+    # Returns a list of BulkFetch
+    def plan_fetches(self, jobs):
+        return []
+
+    # Returns a dict of job data by job, for the jobs found in the
+    # data.  The job data is what the job's convert_result expects.
+    def distribute_data(self, fetch, data):
+        raise NotImplementedError()
+
+    # Returns the jobs that were updated or deferred
+    def update_bulk(self, fetch, transport):
+        headers = dict(fetch.headers)
+        validators, prev_jobs = self.bulk_validators.pop(fetch.url, ({}, ()))
+
+        headers.update(validators)
+
+        response = self.send_request(transport, fetch.url, headers)
+
+        if response is None:
+            return []
+
+        if response is DEFERRED:
+            return fetch.jobs
+
+        if response.status_code == 304:
+            _log.debug("Not modified: {}".format(fetch.url))
+
+            self.bulk_validators[fetch.url] = validators, prev_jobs
+
+            # Only the jobs that got their data from the unchanged
+            # response are known to be unchanged
+            jobs = [x for x in fetch.jobs if x in prev_jobs and x.current_result is not None]
+
+            for job in jobs:
+                job.update_data(NOT_MODIFIED)
+
+            return jobs
+
+        try:
+            jobs_data = self.distribute_data(fetch, response.json())
+        except KeyboardInterrupt:
+            raise
+        except:
+            _log.exception("Failure distributing data from {}".format(fetch.url))
+            return []
+
+        for job, job_data in jobs_data.items():
+            job.update_data(job_data)
+
+        updated_jobs = frozenset(x for x in jobs_data if x.update_failures == 0)
+        self.bulk_validators[fetch.url] = _get_validators(response), updated_jobs
+
+        _log.debug("Fetched {} of {} jobs from {}".format(len(jobs_data), len(fetch.jobs), fetch.url))
+
+        return list(jobs_data)
+
+    # Returns the response, None if the request failed, or DEFERRED if
+    # it was put off to stay within the rate limit.  A 304 Not
+    # Modified response counts as success.
+    def send_request(self, transport, url, headers):
+        acquired = self.acquire_token()
+
+        if acquired is None:
+            _log.debug("Deferring {} to stay within the rate limit".format(url))
+            return DEFERRED
+
+        token, rate_limit = acquired
+        headers = dict(headers)
+
+        if token:
+            headers["Authorization"] = f"{self.auth_scheme} {token}"
+
+        self.hosts.add(transport.get_host_key(url))
 
         try:
             _log.debug("Fetching data from {}".format(url))
 
-            response = session.get(url, headers=headers, timeout=5)
-        except _requests.exceptions.ConnectionError:
-            raise
+            response = transport.get(url, headers=headers)
+        except _CircuitOpenError as e:
+            _log.debug(str(e))
+            return
         except _requests.exceptions.RequestException as e:
             self.log_request_error(str(e), url, headers, None)
             return
 
-        if response.status_code != 200:
+        rate_limit.observe(response)
+
+        if response.status_code == 429 or (response.status_code == 403 and rate_limit.is_exhausted()):
+            _log.warn("Rate limit exceeded: {}".format(url))
+            return DEFERRED
+
+        if response.status_code not in (200, 304):
             message = str(response.status_code)
             self.log_request_error(message, url, headers, response)
             return
 
-        return response.json()
+        return response
 
     def log_request_error(self, message, url, headers, response):
         _log.warn("HTTP request error: {}".format(message))
@@ -409,6 +1201,106 @@ class HttpJob(Job):
             else:
                 _log.debug("Response text:      {}".format(response.text))
 
+# A request for the data of many jobs at once
+class BulkFetch:
+    def __init__(self, url, jobs, headers={}):
+        self.url = url
+        self.jobs = jobs
+        self.headers = headers
+
+    def __repr__(self):
+        return _format_repr(self, self.url)
+
+class HttpJob(Job):
+    __slots__ = ("etag", "last_modified", "fetch_time")
+
+    def __init__(self, model, group, component, environment, agent, name, key):
+        super().__init__(model, group, component, environment, agent, name, key)
+
+        # Response validators for conditional requests
+        self.etag = None
+        self.last_modified = None
+
+        self.fetch_time = 0 # Monotonic time of the last request
+
+    def update_data(self, data):
+        super().update_data(data)
+
+        # Don't trust the validators of a response we failed to use
+        if self.update_failures > 0:
+            self.etag = None
+            self.last_modified = None
+
+    def save_state(self):
+        state = super().save_state()
+        state["etag"] = self.etag
+        state["last_modified"] = self.last_modified
+
+        return state
+
+    def load_state(self, state):
+        super().load_state(state)
+
+        self.etag = state.get("etag")
+        self.last_modified = state.get("last_modified")
+
+    def fetch_data(self, transport, headers={}):
+        headers = dict(headers)
+
+        url = self.data_url
+
+        if self.fetch_url is not None:
+            url = self.fetch_url
+
+        if self.current_result is not None:
+            if self.etag is not None:
+                headers["If-None-Match"] = self.etag
+
+            if self.last_modified is not None:
+                headers["If-Modified-Since"] = self.last_modified
+
+        response = self.agent.send_request(transport, url, headers)
+
+        if response is DEFERRED:
+            return DEFERRED
+
+        self.fetch_time = _time.monotonic()
+
+        if response is None:
+            return
+
+        if response.status_code == 304:
+            _log.debug("Not modified: {}".format(url))
+            return NOT_MODIFIED
+
+        # A body that isn't JSON, such as a login page, is a failed
+        # fetch.  Its validators aren't kept, so the next request
+        # can't be answered with 304 Not Modified.
+        try:
+            data = response.json()
+        except ValueError:
+            _log.warn("Response from {} is not JSON".format(url))
+            return
+
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+
+        return data
+
+# Conditional request headers for a later request for the same resource
+def _get_validators(response):
+    validators = dict()
+
+    if "ETag" in response.headers:
+        validators["If-None-Match"] = response.headers["ETag"]
+
+    if "Last-Modified" in response.headers:
+        validators["If-Modified-Since"] = response.headers["Last-Modified"]
+
+    return validators
+
+_max_run_time = 12 * 60 * 60 * 1000 # Milliseconds
+
 def parse_timestamp(timestamp, format="%Y-%m-%dT%H:%M:%SZ"):
     if timestamp is None:
         return None
@@ -418,6 +1310,126 @@ def parse_timestamp(timestamp, format="%Y-%m-%dT%H:%M:%SZ"):
 
     return int(round(dt.timestamp() * 1000))
 
+# Returns a dict of compressed content by content encoding, in order
+# of preference.  Brotli is used if the module is installed.
+def _compress(content):
+    variants = dict()
+
+    if _brotli is not None:
+        variants["br"] = _brotli.compress(content, quality=5)
+
+    variants["gzip"] = _gzip.compress(content, compresslevel=6, mtime=0)
+
+    return variants
+
+# Merge rendered changes into 'merged'.  Later fragments replace
+# earlier ones.
+def _merge_changes(merged, changes):
+    for name, value in changes.items():
+        if isinstance(value, dict):
+            merged.setdefault(name, dict()).update(value)
+        else:
+            merged[name] = value
+
+# Join pre-rendered JSON values into a JSON object, in key order
+def _join_fragments(fragments):
+    items = ["\"{}\": {}".format(x, fragments[x]) for x in sorted(fragments)]
+    return "{{{}}}".format(", ".join(items))
+
+def _render_delta(json, version, full):
+    fields = {
+        "version": _json.dumps(version),
+        "full": _json.dumps(full),
+        "data": json,
+    }
+
+    return _join_fragments(fields).encode("utf-8")
+
+_result_fields = ("number", "status", "start_time", "duration", "html_url", "data_url", "tests_url", "logs_url")
+_job_url_fields = ("html_url", "data_url")
+_result_url_fields = ("html_url", "data_url", "tests_url", "logs_url")
+
+# Convert data in the default format to the compact columnar format
+# (format 2).
+#
+# Each collection becomes a dict of columns, each a list indexed by
+# object ID.  Job results are gathered into the "results" collection,
+# and jobs refer to them by index.  Result statuses are indexes into
+# "statuses".  Job and result URLs that start with an agent URL are
+# [prefix index, suffix] pairs, with the agent URLs in "prefixes".
+def _convert_columnar(data):
+    prefixes = {x[y] for x in data["agents"].values() for y in ("html_url", "data_url") if x[y]}
+    prefixes = sorted(prefixes, key=lambda x: (-len(x), x)) # Longest first
+
+    statuses = [PASSED, FAILED]
+    status_indexes = {x: i for i, x in enumerate(statuses)}
+
+    prefix_indexes = {x: i for i, x in enumerate(prefixes)}
+    prefix_expr = _re.compile("|".join(_re.escape(x) for x in prefixes) or "(?!)")
+
+    def convert_url(url):
+        if url is not None:
+            match = prefix_expr.match(url)
+
+            if match is not None:
+                return [prefix_indexes[match.group(0)], url[match.end():]]
+
+        return url
+
+    results = list()
+
+    def add_result(result):
+        if result is None:
+            return None
+
+        result = dict(result)
+        status = result["status"]
+
+        if status is not None:
+            if status not in status_indexes:
+                status_indexes[status] = len(statuses)
+                statuses.append(status)
+
+            result["status"] = status_indexes[status]
+
+        for field in _result_url_fields:
+            result[field] = convert_url(result[field])
+
+        results.append(result)
+
+        return len(results) - 1
+
+    jobs = _sorted_by_id(data["jobs"])
+
+    for job in jobs:
+        for field in _job_url_fields:
+            job[field] = convert_url(job[field])
+
+        job["previous_result"] = add_result(job["previous_result"])
+        job["current_result"] = add_result(job["current_result"])
+
+    return {
+        "format": 2,
+        "title": data["title"],
+        "update_time": data["update_time"],
+        "prefixes": prefixes,
+        "statuses": statuses,
+        "categories": _to_columns(_sorted_by_id(data["categories"])),
+        "groups": _to_columns(_sorted_by_id(data["groups"])),
+        "components": _to_columns(_sorted_by_id(data["components"])),
+        "environments": _to_columns(_sorted_by_id(data["environments"])),
+        "agents": _to_columns(_sorted_by_id(data["agents"])),
+        "jobs": _to_columns(jobs),
+        "results": {x: [y.get(x) for y in results] for x in _result_fields},
+    }
+
+def _sorted_by_id(objects):
+    return sorted(objects.values(), key=lambda x: x["id"])
+
+def _to_columns(objects):
+    names = sorted({x for y in objects for x in y if x != "id"})
+    return {x: [y.get(x) for y in objects] for x in names}
+
 def _format_repr(obj, *args):
     cls = obj.__class__.__name__
     strings = [str(x) for x in args]
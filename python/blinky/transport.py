@@ -0,0 +1,610 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import collections as _collections
+import concurrent.futures as _futures
+import email.utils as _email_utils
+import logging as _logging
+import random as _random
+import requests as _requests
+import threading as _threading
+import time as _time
+import urllib.parse as _parse
+
+_log = _logging.getLogger("blinky.transport")
+
+# A long-lived connection pool per upstream host.  Connections are
+# kept alive across update cycles, so the TCP and TLS handshakes are
+# paid once per process instead of once per fetch.
+#
+# Timeouts adapt to each host's observed latency.  Failed requests
+# are retried with jittered backoff, and with hedging enabled, a
+# request slower than the host's 95th percentile gets a second copy.
+# Retries and hedges share a budget, so a struggling upstream doesn't
+# get extra load.  The budget is a token bucket that refills over
+# time, holding retry_ratio of the requests sent in the last
+# retry_window seconds, and no less than min_retry_budget.
+class HttpTransport:
+    def __init__(self):
+        self.pool_size = 16           # Connections kept alive per host
+        self.idle_timeout = 60 * 60   # Seconds before an unused host is evicted
+
+        self.hedging = False          # Send a second request when the first is slow
+        self.max_retries = 2
+        self.retry_delay = 0.5        # Seconds, doubled for each retry
+        self.retry_ratio = 0.1        # Of the requests in the window
+        self.retry_window = 60        # Seconds
+        self.min_retry_budget = 10    # Retries and hedges per window
+
+        self.retry_budget = self.min_retry_budget
+        self._budget_time = _time.monotonic()
+        self._window = _collections.deque() # [Second, request count]
+        self._window_requests = 0
+
+        self._hosts = dict()          # By scheme and host
+        self._lock = _threading.Lock()
+        self._executor = _futures.ThreadPoolExecutor(32, "hedge")
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, len(self._hosts))
+
+    # Idempotent requests only.  The timeout defaults to one based on
+    # the host's latency.
+    def get(self, url, **kwargs):
+        host = self._get_host(url)
+
+        if "timeout" not in kwargs:
+            kwargs["timeout"] = host.latency.get_timeout()
+
+        # The breaker sees each request once, however many attempts it
+        # takes.  Only signs that the host itself is down or
+        # overloaded count against it.  An error from one bad job
+        # doesn't.
+        if not host.breaker.allow():
+            host.rejected += 1
+            raise CircuitOpenError(f"The circuit to {host.key} is open")
+
+        try:
+            response = self._get(host, url, kwargs)
+        except _host_errors:
+            host.breaker.record_failure()
+            raise
+        except _requests.exceptions.RequestException:
+            host.breaker.record_success()
+            raise
+
+        if response.status_code in _retry_statuses:
+            host.breaker.record_failure()
+        else:
+            host.breaker.record_success()
+
+        return response
+
+    def _get(self, host, url, kwargs):
+        attempt = 0
+
+        while True:
+            try:
+                response = self._send(host, url, kwargs)
+            except _requests.exceptions.RequestException:
+                if attempt == self.max_retries or not self._spend_retry_budget():
+                    raise
+            else:
+                if response.status_code not in _retry_statuses or attempt == self.max_retries \
+                   or not self._spend_retry_budget():
+                    return response
+
+            attempt += 1
+            host.retried += 1
+
+            delay = _random.uniform(0, self.retry_delay * 2 ** attempt)
+
+            _log.debug("Retrying {} in {:.2f}s".format(url, delay))
+
+            _time.sleep(delay)
+
+    def _send(self, host, url, kwargs):
+        if self.hedging and host.latency.is_ready():
+            return self._send_hedged(host, url, kwargs)
+
+        return self._send_once(host, url, kwargs)
+
+    def _send_once(self, host, url, kwargs):
+        with self._lock:
+            self._count_request(int(_time.monotonic()))
+
+        start = _time.perf_counter()
+
+        try:
+            response = host.session.get(url, **kwargs)
+        except _requests.exceptions.Timeout:
+            # Count it as a slow response, so the timeouts grow
+            host.latency.record(_time.perf_counter() - start)
+            host.errors += 1
+            raise
+        except _requests.exceptions.RequestException:
+            host.errors += 1
+            raise
+
+        host.latency.record(_time.perf_counter() - start)
+        host.requests += 1
+
+        return response
+
+    def _send_hedged(self, host, url, kwargs):
+        primary = self._executor.submit(self._send_once, host, url, kwargs)
+
+        try:
+            return primary.result(timeout=host.latency.get_percentile(0.95))
+        except _futures.TimeoutError:
+            pass
+
+        if not self._spend_retry_budget():
+            return primary.result()
+
+        _log.debug("Hedging {}".format(url))
+
+        host.hedged += 1
+        hedge = self._executor.submit(self._send_once, host, url, kwargs)
+
+        # The first to succeed wins.  The other runs to completion in
+        # the background.
+        error = None
+
+        for future in _futures.as_completed((primary, hedge)):
+            try:
+                return future.result()
+            except _requests.exceptions.RequestException as e:
+                error = e
+
+        raise error
+
+    def _spend_retry_budget(self):
+        with self._lock:
+            self._refill_retry_budget(_time.monotonic())
+
+            if self.retry_budget < 1:
+                return False
+
+            self.retry_budget -= 1
+
+            return True
+
+    # Requests are counted per second, so the window stays small
+    def _count_request(self, second):
+        if self._window and self._window[-1][0] == second:
+            self._window[-1][1] += 1
+        else:
+            self._window.append([second, 1])
+
+        self._window_requests += 1
+
+    def _refill_retry_budget(self, now):
+        while self._window and self._window[0][0] <= now - self.retry_window:
+            self._window_requests -= self._window.popleft()[1]
+
+        capacity = max(self.min_retry_budget, self._window_requests * self.retry_ratio)
+        rate = capacity / self.retry_window
+
+        self.retry_budget = min(capacity, self.retry_budget + (now - self._budget_time) * rate)
+        self._budget_time = now
+
+    @staticmethod
+    def get_host_key(url):
+        scheme, netloc = _parse.urlsplit(url)[:2]
+        return f"{scheme}://{netloc}"
+
+    # Returns None if the host is unknown or was evicted
+    def get_breaker(self, key):
+        with self._lock:
+            host = self._hosts.get(key)
+
+        if host is not None:
+            return host.breaker
+
+    def _get_host(self, url):
+        key = self.get_host_key(url)
+
+        with self._lock:
+            try:
+                host = self._hosts[key]
+            except KeyError:
+                host = self._hosts[key] = _HttpHost(key, self.pool_size)
+
+            host.last_used = _time.monotonic()
+
+        return host
+
+    def evict_idle(self):
+        now = _time.monotonic()
+
+        with self._lock:
+            idle_hosts = [x for x in self._hosts.values() if now - x.last_used > self.idle_timeout]
+
+            for host in idle_hosts:
+                del self._hosts[host.key]
+
+        for host in idle_hosts:
+            _log.info("Evicting idle connections to {}".format(host.key))
+            host.session.close()
+
+    def stats(self):
+        with self._lock:
+            hosts = list(self._hosts.values())
+
+        return {x.key: x.stats() for x in hosts}
+
+    def close(self):
+        with self._lock:
+            hosts = list(self._hosts.values())
+            self._hosts.clear()
+
+        for host in hosts:
+            host.session.close()
+
+class _HttpHost:
+    def __init__(self, key, pool_size):
+        self.key = key
+        self.last_used = _time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.retried = 0
+        self.hedged = 0
+
+        self.breaker = CircuitBreaker(key)
+        self.latency = _Latency()
+
+        self.adapter = _requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+
+        self.session = _requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def stats(self):
+        pools = self.adapter.poolmanager.pools
+        connections = sum(pools[x].num_connections for x in pools.keys())
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "retried": self.retried,
+            "hedged": self.hedged,
+            "circuit": self.breaker.state,
+            "latency": self.latency.stats(),
+            "connections": connections,
+            "idle_seconds": round(_time.monotonic() - self.last_used, 1),
+        }
+
+_retry_statuses = (502, 503, 504)
+_host_errors = (_requests.exceptions.ConnectionError, _requests.exceptions.Timeout)
+
+# Recent response times for one host
+class _Latency:
+    def __init__(self):
+        self.average = None # Seconds, a moving average
+        self.samples = _collections.deque(maxlen=200)
+
+    def record(self, seconds):
+        if self.average is None:
+            self.average = seconds
+        else:
+            self.average = 0.8 * self.average + 0.2 * seconds
+
+        self.samples.append(seconds)
+
+    def is_ready(self):
+        return len(self.samples) >= _min_latency_samples
+
+    def get_percentile(self, fraction):
+        samples = sorted(self.samples)
+        return samples[int(fraction * (len(samples) - 1))]
+
+    # Returns (connect timeout, read timeout) in seconds
+    def get_timeout(self):
+        if not self.is_ready():
+            return _default_timeout
+
+        connect = _clamp(3 * self.average, _min_connect_timeout, _max_connect_timeout)
+        read = _clamp(4 * self.get_percentile(0.99), _min_read_timeout, _max_read_timeout)
+
+        return connect, read
+
+    def stats(self):
+        if not self.is_ready():
+            return
+
+        return {
+            "average": round(self.average, 3),
+            "p95": round(self.get_percentile(0.95), 3),
+            "p99": round(self.get_percentile(0.99), 3),
+            "timeout": [round(x, 3) for x in self.get_timeout()],
+        }
+
+_min_latency_samples = 20
+_default_timeout = (5, 5)     # Seconds
+_min_connect_timeout = 1      # Seconds
+_max_connect_timeout = 10     # Seconds
+_min_read_timeout = 2         # Seconds
+_max_read_timeout = 30        # Seconds
+
+def _clamp(value, min_value, max_value):
+    return max(min_value, min(value, max_value))
+
+class CircuitOpenError(_requests.exceptions.RequestException):
+    pass
+
+# Fail fast when a host is down.  After failure_threshold consecutive
+# failed requests (connection errors, timeouts, or 502, 503, or 504
+# responses after any retries), the circuit opens and requests fail
+# without being sent.  After a wait, one probe request
+# is let through.  If it succeeds, the circuit closes.  If it fails,
+# the circuit opens again for twice as long.
+class CircuitBreaker:
+    def __init__(self, key):
+        self.key = key
+        self.failure_threshold = 5
+        self.min_open_time = 10       # Seconds
+        self.max_open_time = 5 * 60   # Seconds
+
+        self.state = "closed"         # closed, open, or half-open
+        self.failures = 0             # Consecutive failures
+        self.open_time = self.min_open_time
+        self.retry_time = None        # Epoch seconds
+
+        self._lock = _threading.Lock()
+
+    def __repr__(self):
+        return "{}({},{})".format(self.__class__.__name__, self.key, self.state)
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+
+            if self.state == "open" and _time.time() >= self.retry_time:
+                _log.info("Probing {}".format(self.key))
+
+                self.state = "half-open"
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                _log.info("Closing the circuit to {}".format(self.key))
+
+            self.state = "closed"
+            self.failures = 0
+            self.open_time = self.min_open_time
+            self.retry_time = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.state == "half-open":
+                self.open_time = min(self.open_time * 2, self.max_open_time)
+                self._open()
+            elif self.state == "closed" and self.failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        _log.warning("Opening the circuit to {} for {}s".format(self.key, self.open_time))
+
+        self.state = "open"
+        self.retry_time = _time.time() + self.open_time
+
+    def render_data(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "retry_time": _to_millis(self.retry_time),
+            }
+
+# A token bucket that paces requests to stay within a service's rate
+# limit.  The limit is learned from response headers: X-RateLimit-*
+# (GitHub), RateLimit-* (GitLab and others), and Retry-After.  Until
+# a limit is seen, requests aren't paced.
+#
+# The bucket refills at the rate that would spend the remaining budget
+# evenly until the limit resets, and holds up to burst_period seconds
+# of that budget.
+class RateLimit:
+    def __init__(self):
+        self.reserve = 0.05      # Fraction of the limit left unspent
+        self.burst_period = 60   # Seconds
+
+        self.limit = None
+        self.remaining = None
+        self.reset_time = None   # Epoch seconds
+        self.retry_time = None   # Epoch seconds
+        self.usage_rate = None   # Requests per second, a moving average
+
+        self._rate = None        # Tokens per second
+        self._tokens = 0
+        self._fill_time = None
+        self._sample = None      # (Time, remaining)
+        self._lock = _threading.Lock()
+
+    def __repr__(self):
+        return "{}({}/{})".format(self.__class__.__name__, self.remaining, self.limit)
+
+    # Returns False if the request should be put off
+    def acquire(self):
+        now = _time.time()
+
+        with self._lock:
+            if self.retry_time is not None and now < self.retry_time:
+                return False
+
+            if self._rate is None:
+                return True
+
+            # The limit has reset.  Don't pace until we learn the new
+            # budget.
+            if now >= self.reset_time:
+                self._rate = None
+                return True
+
+            self._tokens = min(self._capacity(), self._tokens + (now - self._fill_time) * self._rate)
+            self._fill_time = now
+
+            if self._tokens < 1:
+                return False
+
+            self._tokens -= 1
+
+            return True
+
+    def observe(self, response):
+        headers = response.headers
+        now = _time.time()
+
+        limit = _get_int_header(headers, "X-RateLimit-Limit", "RateLimit-Limit")
+        remaining = _get_int_header(headers, "X-RateLimit-Remaining", "RateLimit-Remaining")
+        reset_time = _get_int_header(headers, "X-RateLimit-Reset", "RateLimit-Reset")
+        retry_time = _parse_retry_after(headers.get("Retry-After"), now)
+
+        with self._lock:
+            if retry_time is not None:
+                self.retry_time = retry_time
+
+            if limit is None or remaining is None or reset_time is None:
+                return
+
+            # Some services send seconds until the reset instead of a
+            # timestamp
+            if reset_time < 1000000000:
+                reset_time += now
+
+            self._update_usage(now, remaining, reset_time)
+
+            self.limit = limit
+            self.remaining = remaining
+            self.reset_time = reset_time
+
+            budget = max(0, remaining - self.reserve * limit)
+
+            if self._rate is None:
+                self._tokens = budget
+                self._fill_time = now
+
+            self._rate = budget / max(1, reset_time - now)
+            self._tokens = min(self._tokens, self._capacity(), budget)
+
+    def _capacity(self):
+        return max(1, self._rate * self.burst_period)
+
+    def _update_usage(self, now, remaining, reset_time):
+        if self._sample is None or self.reset_time is None or abs(reset_time - self.reset_time) > 1:
+            self._sample = now, remaining
+            return
+
+        elapsed = now - self._sample[0]
+
+        if elapsed < 10:
+            return
+
+        rate = max(0, self._sample[1] - remaining) / elapsed
+
+        if self.usage_rate is None:
+            self.usage_rate = rate
+        else:
+            self.usage_rate = 0.7 * self.usage_rate + 0.3 * rate
+
+        self._sample = now, remaining
+
+    # The remaining budget, or infinity if it is unknown
+    def get_budget(self):
+        with self._lock:
+            if self.remaining is None or _time.time() >= self.reset_time:
+                return float("inf")
+
+            return self.remaining - self.reserve * self.limit
+
+    def is_exhausted(self):
+        now = _time.time()
+
+        with self._lock:
+            if self.retry_time is not None and now < self.retry_time:
+                return True
+
+            return self.remaining == 0 and now < self.reset_time
+
+    # The time the limit will run out at the current rate of use, or
+    # None if it won't before it resets
+    def get_exhaustion_time(self):
+        with self._lock:
+            if self.remaining is None:
+                return
+
+            if self.remaining == 0:
+                return _time.time()
+
+            if not self.usage_rate:
+                return
+
+            exhaustion_time = _time.time() + self.remaining / self.usage_rate
+
+            if exhaustion_time < self.reset_time:
+                return exhaustion_time
+
+    def render_data(self):
+        if self.limit is None and self.retry_time is None:
+            return
+
+        return {
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "reset_time": _to_millis(self.reset_time),
+            "retry_time": _to_millis(self.retry_time),
+            "exhaustion_time": _to_millis(self.get_exhaustion_time()),
+        }
+
+def _get_int_header(headers, *names):
+    for name in names:
+        value = headers.get(name)
+
+        if value is not None:
+            try:
+                return int(value)
+            except ValueError:
+                pass
+
+def _parse_retry_after(value, now):
+    if value is None:
+        return
+
+    try:
+        return now + int(value)
+    except ValueError:
+        pass
+
+    try:
+        return _email_utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        pass
+
+def _to_millis(timestamp):
+    if timestamp is not None:
+        return int(round(timestamp * 1000))
@@ -41,22 +41,29 @@ class TravisAgent(HttpAgent):
         self.token = token
 
 class TravisJob(HttpJob):
+    __slots__ = ("repo", "branch")
+
     def __init__(self, model, group, component, environment, agent, name, repo, branch):
-        super().__init__(model, group, component, environment, agent, name)
+        super().__init__(model, group, component, environment, agent, name, f"{repo}/{branch}")
 
         self.repo = repo
         self.branch = branch
 
-        self.html_url = f"{self.agent.html_url}/{self.repo}/branches"
-        self.data_url = f"{self.agent.data_url}/repos/{self.repo}/branches/{self.branch}"
+    @property
+    def html_url(self):
+        return f"{self.agent.html_url}/{self.repo}/branches"
+
+    @property
+    def data_url(self):
+        return f"{self.agent.data_url}/repos/{self.repo}/branches/{self.branch}"
 
-    def fetch_data(self, session):
+    def fetch_data(self, transport):
         headers = {
             "User-Agent": "Blinky/0.1",
             "Accept": "application/vnd.travis-ci.2+json",
         }
 
-        return super().fetch_data(session, headers)
+        return super().fetch_data(transport, headers)
 
     def convert_result(self, data):
         data = data["branch"]
@@ -74,7 +81,7 @@ class TravisJob(HttpJob):
         html_url = f"{self.agent.html_url}/{self.repo}/builds/{build_id}"
         data_url = f"{self.agent.data_url}/builds/{build_id}"
 
-        result = JobResult()
+        result = JobResult(self)
         result.number = int(data["number"])
         result.status = status
         result.start_time = start_time
@@ -17,11 +17,15 @@
 # under the License.
 #
 
+import concurrent.futures as _futures
 import datetime as _datetime
 import functools as _functools
+import gzip as _gzip
 import hashlib as _hashlib
+import io as _io
 import logging as _logging
 import os as _os
+import posixpath as _posixpath
 import pprint as _pprint
 import re as _re
 import sched as _sched
@@ -34,12 +38,23 @@ import uuid as _uuid
 
 from tornado.httpserver import HTTPServer as _HTTPServer
 from tornado.ioloop import IOLoop as _IOLoop
+from tornado.iostream import StreamClosedError as _StreamClosedError
+from tornado.locks import Event as _Event
+from tornado.web import Application as _TornadoApplication
+from tornado.web import FallbackHandler as _FallbackHandler
+from tornado.util import TimeoutError as _TimeoutError
+from tornado.web import RequestHandler as _RequestHandler
 from tornado.wsgi import WSGIContainer as _WSGIContainer
 from urllib.parse import quote_plus as _url_escape
 from urllib.parse import unquote_plus as _url_unescape
 from xml.sax.saxutils import escape as _xml_escape
 from xml.sax.saxutils import unescape as _xml_unescape
 
+try:
+    import brotli as _brotli
+except ImportError:
+    _brotli = None
+
 _log = _logging.getLogger("brbn")
 
 _xhtml = "application/xhtml+xml; charset=utf-8"
@@ -59,6 +74,15 @@ _content_types_by_extension = {
     ".woff": "application/font-woff",
 }
 
+# Files of these types are compressed at load time
+_compressible_extensions = (".css", ".html", ".js", ".json", ".svg", ".txt")
+
+# Files of these types are also served under a content-hashed path,
+# and HTML files are rewritten to refer to that path
+_fingerprinted_extensions = (".css", ".js")
+
+_reference_expr = _re.compile(r"(\s(?:href|src)=\")([^\"]+)(\")")
+
 _page_template = """<!DOCTYPE html>
 <html xmlns="http://www.w3.org/1999/xhtml">
   <head>
@@ -148,6 +172,7 @@ class Application:
         self._brbn_home = None
 
         self._resources = dict()
+        self._event_streams = dict()
 
         self._root_resource = None
         self._error_page = _ErrorPage(self)
@@ -157,6 +182,10 @@ class Application:
 
         self.debug = "BRBN_DEBUG" in _os.environ
 
+        # Threads in each pool for blocking resources, by pool name.
+        # Pools not listed here get the default size.
+        self.pool_sizes = {"default": 8}
+
     def __repr__(self):
         return _format_repr(self, self.home)
 
@@ -175,6 +204,10 @@ class Application:
     @property
     def resources(self):
         return self._resources
+
+    @property
+    def event_streams(self):
+        return self._event_streams
     
     @property
     def root_resource(self):
@@ -198,7 +231,48 @@ class Application:
 
         for path, resource in sorted(self.resources.items()):
             resource.load()
-        
+
+        # In debug mode, files are reloaded on each request, so the
+        # plain paths are used instead
+        if not self.debug:
+            self._fingerprint_files()
+
+    def _fingerprint_files(self):
+        files = [x for x in self.resources.values() if isinstance(x, File)]
+        paths = dict() # Fingerprinted path by path
+
+        for file in files:
+            name, ext = _os.path.splitext(file.path)
+
+            if ext in _fingerprinted_extensions:
+                path = "{}.{}{}".format(name, file._etag, ext)
+                paths[file.path] = _ImmutableFile(self, path, file).path
+
+        if not paths:
+            return
+
+        def rewrite(file, match):
+            ref = match.group(2)
+
+            if ":" in ref or ref.startswith("//"):
+                return match.group(0)
+
+            path = _posixpath.normpath(_posixpath.join(_posixpath.dirname(file.path), ref))
+
+            if path not in paths:
+                return match.group(0)
+
+            return "{}{}{}".format(match.group(1), paths[path], match.group(3))
+
+        for file in files:
+            if not file.path.endswith(".html"):
+                continue
+
+            text = file._content.decode("utf-8")
+            text = _reference_expr.sub(_functools.partial(rewrite, file), text)
+
+            file._set_content(text.encode("utf-8"))
+
     def _add_files(self, files_dir):
         if not _os.path.isdir(files_dir):
             return
@@ -397,6 +471,28 @@ class Request:
 
         return True
 
+    # Returns the first of the server's content encodings, in order
+    # of preference, that the client accepts with the highest
+    # quality, or None for no encoding
+    def choose_encoding(self, encodings):
+        header = self.env.get("HTTP_ACCEPT_ENCODING")
+
+        if not header:
+            return
+
+        accepted = _parse_accept_encoding(header)
+        choice = None
+        choice_quality = 0
+
+        for encoding in encodings:
+            quality = accepted.get(encoding, accepted.get("*", 0))
+
+            if quality > choice_quality:
+                choice = encoding
+                choice_quality = quality
+
+        return choice
+
     def add_response_header(self, name, value):
         self.response_headers.append((name, str(value)))
     
@@ -418,6 +514,9 @@ class Request:
             self._start_response(status, self.response_headers)
             return (b"",)
 
+        if not isinstance(content, (str, bytes)):
+            return self._respond_streaming(status, content, content_type)
+
         if isinstance(content, str):
             content = content.encode("utf-8")
         
@@ -433,6 +532,24 @@ class Request:
 
         return (content,)
 
+    # Content is an iterable of chunks, sent as they are produced
+    def _respond_streaming(self, status, content, content_type):
+        assert content_type is not None
+
+        self.add_response_header("Content-Type", content_type)
+
+        self._start_response(status, self.response_headers)
+
+        try:
+            for chunk in content:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+
+                yield chunk
+        finally:
+            if hasattr(content, "close"):
+                content.close()
+
     def respond_ok(self, content, content_type):
         return self.respond("200 OK", content, content_type)
     
@@ -480,7 +597,38 @@ class Request:
 class _RequestError(Exception):
     pass
 
+def _parse_accept_encoding(header):
+    accepted = dict()
+
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+
+        if coding:
+            accepted[coding.strip().lower()] = quality
+
+    return accepted
+
 class Resource:
+    # Set to True for resources that block, for instance on network
+    # IO.  The server runs them on a thread pool instead of the IO
+    # loop.
+    blocking = False
+
+    # The thread pool for a blocking resource.  Resources that wait on
+    # slow upstream servers can use a pool of their own, so they can't
+    # starve the others.
+    pool = "default"
+
     def __init__(self, app, path):
         self._app = app
         self._path = path
@@ -511,6 +659,11 @@ class Resource:
     def get_etag(self, request):
         pass
 
+    # Returns the content encodings, such as "br" and "gzip", that
+    # render_encoded can produce, in order of preference
+    def get_encodings(self, request):
+        pass
+
     def get_href(self, request, **params):
         if not params:
             return self.path
@@ -539,14 +692,29 @@ class Resource:
 
     def send_response(self, request):
         etag =  self.get_etag(request)
+        encodings = self.get_encodings(request)
+        encoding = None
+
+        if encodings:
+            request.add_response_header("Vary", "Accept-Encoding")
+            encoding = request.choose_encoding(encodings)
 
         if etag is not None:
+            # Each encoding is a distinct representation
+            if encoding is not None:
+                etag = "{}-{}".format(etag, encoding)
+
             if not request.is_modified(etag):
                 return request.respond_not_modified()
             
             request.add_response_header("ETag", "\"{}\"".format(etag))
 
-        content = self.render(request)
+        if encoding is None:
+            content = self.render(request)
+        else:
+            content = self.render_encoded(request, encoding)
+            request.add_response_header("Content-Encoding", encoding)
+
         content_type = self.get_content_type(request)
         
         return request.respond_ok(content, content_type)
@@ -556,7 +724,97 @@ class Resource:
     
     def render(self, request):
         raise NotImplementedError()
+
+    def render_encoded(self, request, encoding):
+        raise NotImplementedError()
     
+# A Server-Sent Events stream.  Unlike resources, event streams are
+# served directly by the Tornado IO loop, so they can stay open.
+# publish() is safe to call from any thread.
+class EventStream:
+    def __init__(self, app, path):
+        self._app = app
+        self._path = path
+        self._handlers = set()
+        self._io_loop = None
+
+        self.keepalive_interval = 30 # Seconds
+
+        self.app.event_streams[self.path] = self
+
+    def __repr__(self):
+        return _format_repr(self, self.path)
+
+    @property
+    def app(self):
+        return self._app
+
+    @property
+    def path(self):
+        return self._path
+
+    def publish(self, data, event=None):
+        if self._io_loop is None:
+            return
+
+        lines = list()
+
+        if event is not None:
+            lines.append("event: {}".format(event))
+
+        for line in data.splitlines():
+            lines.append("data: {}".format(line))
+
+        message = "{}\n\n".format("\n".join(lines))
+
+        self._io_loop.add_callback(self._send, message)
+
+    def _send(self, message):
+        for handler in list(self._handlers):
+            handler.send(message)
+
+class _EventStreamHandler(_RequestHandler):
+    def initialize(self, stream):
+        self._stream = stream
+        self._closed = _Event()
+
+    async def get(self):
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("X-Accel-Buffering", "no")
+
+        self._stream._handlers.add(self)
+
+        try:
+            self.send(": connected\n\n")
+
+            while not self._closed.is_set():
+                try:
+                    await self._closed.wait(_datetime.timedelta(seconds=self._stream.keepalive_interval))
+                except _TimeoutError:
+                    self.send(": keepalive\n\n")
+        finally:
+            self._stream._handlers.discard(self)
+
+    def on_connection_close(self):
+        self._closed.set()
+
+    def send(self, message):
+        if self._closed.is_set():
+            return
+
+        try:
+            self.write(message)
+            self.flush().add_done_callback(self._flushed)
+        except _StreamClosedError:
+            self._closed.set()
+
+    def _flushed(self, future):
+        if future.exception() is not None:
+            self._closed.set()
+
+# A static file.  The content and its compressed variants are
+# prepared at load time.
 class File(Resource):
     def __init__(self, app, path, fs_path):
         super().__init__(app, path)
@@ -564,17 +822,27 @@ class File(Resource):
         self._fs_path = fs_path
         self._content = None
         self._etag = None
+        self._variants = dict() # Content by encoding
 
     def get_etag(self, request):
         return self._etag
 
+    def get_encodings(self, request):
+        return list(self._variants)
+
     def load(self):
         super().load()
 
         with open(self._fs_path, "rb") as f:
-            self._content = f.read()
+            self._set_content(f.read())
+
+    def _set_content(self, content):
+        self._content = content
+        self._etag = compute_etag(content)
+        self._variants = dict()
 
-        self._etag = compute_etag(self._content)
+        if _os.path.splitext(self.path)[1] in _compressible_extensions:
+            self._variants = _compress(content)
 
     def process(self, request):
         max_age = 120
@@ -587,7 +855,38 @@ class File(Resource):
 
     def render(self, request):
         return self._content
-    
+
+    def render_encoded(self, request, encoding):
+        return self._variants[encoding]
+
+# A file served under a path containing its content hash.  The content
+# at the path never changes, so clients can cache it indefinitely.
+class _ImmutableFile(File):
+    def __init__(self, app, path, file):
+        super().__init__(app, path, file._fs_path)
+
+        self._content = file._content
+        self._etag = file._etag
+        self._variants = file._variants
+
+    def load(self):
+        pass
+
+    def process(self, request):
+        request.add_response_header("Cache-Control", "public, max-age=31536000, immutable")
+
+# Compressed variants of the content, in order of preference.
+# Variants that aren't smaller than the content are left out.
+def _compress(content):
+    variants = dict()
+
+    if _brotli is not None:
+        variants["br"] = _brotli.compress(content)
+
+    variants["gzip"] = _gzip.compress(content, compresslevel=9, mtime=0)
+
+    return {k: v for k, v in variants.items() if len(v) < len(content)}
+
 class Page(Resource):
     def __init__(self, app, path, body):
         super().__init__(app, path)
@@ -947,16 +1246,155 @@ class _SessionExpireThread(_threading.Thread):
 
         _log.debug("Expired {} client sessions".format(count))
         
+# Serves an application directly from Tornado.  Resources run on the
+# IO loop unless they are marked blocking.
+class _ApplicationHandler(_RequestHandler):
+    def initialize(self, app, server):
+        self._app = app
+        self._server = server
+
+    def compute_etag(self):
+        # Resources do their own ETag processing
+        return None
+
+    async def get(self):
+        env = _wsgi_environ(self.request)
+        response = list()
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = status, headers
+
+        resource = self._app.resources.get(env["PATH_INFO"])
+        executor = None
+
+        if resource is not None and resource.blocking:
+            executor = self._server._get_executor(resource.pool)
+
+        content = await self._call(executor, self._app, env, start_response)
+        streaming = not isinstance(content, (list, tuple))
+
+        if streaming:
+            # Pulling the first chunk runs the response generator
+            # through its start_response call
+            chunk = await self._call(executor, next, content, None)
+
+        status, headers = response
+        code, reason = status.split(" ", 1)
+
+        self.set_status(int(code), reason)
+        self.clear_header("Content-Type")
+
+        for name, value in headers:
+            self.add_header(name, value)
+
+        if streaming:
+            await self._write_streaming(executor, chunk, content)
+            return
+
+        for chunk in content:
+            if chunk:
+                self.write(chunk)
+
+    async def _write_streaming(self, executor, chunk, content):
+        try:
+            while chunk is not None:
+                if chunk:
+                    self.write(chunk)
+                    await self.flush()
+
+                chunk = await self._call(executor, next, content, None)
+        except _StreamClosedError:
+            pass
+        except Exception:
+            _log.exception("Failure streaming content")
+        finally:
+            await self._call(executor, content.close)
+
+    async def _call(self, executor, func, *args):
+        if executor is not None:
+            return await _IOLoop.current().run_in_executor(executor, func, *args)
+
+        return func(*args)
+
+    head = get
+    post = get
+
+def _wsgi_environ(request):
+    host, port = request.host, None
+
+    # An IPv6 host is in brackets
+    if ":" in host.rsplit("]", 1)[-1]:
+        host, port = host.rsplit(":", 1)
+
+    if not port:
+        port = "443" if request.protocol == "https" else "80"
+
+    path = _urllib.parse.unquote_to_bytes(request.path).decode("latin1")
+
+    env = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path,
+        "QUERY_STRING": request.query,
+        "REMOTE_ADDR": request.remote_ip,
+        "SERVER_NAME": host,
+        "SERVER_PORT": port,
+        "SERVER_PROTOCOL": request.version,
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.protocol,
+        "wsgi.input": _io.BytesIO(request.body),
+        "wsgi.errors": _sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    if "Content-Type" in request.headers:
+        env["CONTENT_TYPE"] = request.headers["Content-Type"]
+
+    if "Content-Length" in request.headers:
+        env["CONTENT_LENGTH"] = request.headers["Content-Length"]
+
+    for name, value in request.headers.items():
+        env["HTTP_{}".format(name.replace("-", "_").upper())] = value
+
+    return env
+
 class Server:
-    def __init__(self, app, port=8000):
+    def __init__(self, app, port=8000, wsgi=False):
         self._app = app
         self._port = port
 
-        self._tornado_server = _HTTPServer(_WSGIContainer(self._app))
+        # For blocking resources, by pool name.  They are created on
+        # first use, on the IO loop.
+        self._executors = dict()
+
+        handlers = list()
+
+        for path, stream in self._app.event_streams.items():
+            handlers.append((path, _EventStreamHandler, {"stream": stream}))
+
+        if wsgi:
+            handlers.append((r".*", _FallbackHandler, {"fallback": _WSGIContainer(self._app)}))
+        else:
+            handlers.append((r".*", _ApplicationHandler, {"app": self._app, "server": self}))
+
+        self._tornado_server = _HTTPServer(_TornadoApplication(handlers))
 
     def __repr__(self):
         return _format_repr(self, self._app, self._port)
 
+    def _get_executor(self, pool):
+        try:
+            return self._executors[pool]
+        except KeyError:
+            size = self._app.pool_sizes.get(pool, self._app.pool_sizes["default"])
+            executor = _futures.ThreadPoolExecutor(size, thread_name_prefix="brbn-{}".format(pool))
+
+            self._executors[pool] = executor
+
+            return executor
+
     def run(self):
         _log.info("Starting {}".format(self))
 
@@ -966,7 +1404,12 @@ class Server:
             msg = "Cannot listen on port {}: {}".format(self._port, str(e))
             raise Error(msg)
 
-        _IOLoop.instance().start()
+        io_loop = _IOLoop.current()
+
+        for stream in self._app.event_streams.values():
+            stream._io_loop = io_loop
+
+        io_loop.start()
 
 class Hello(Application):
     def __init__(self, home):
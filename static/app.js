@@ -23,6 +23,10 @@
 
 const gesso = new Gesso();
 
+// Agents not updated within this many milliseconds of the data are
+// flagged in the footer
+const staleAgentTime = 60 * 60 * 1000;
+
 class Blinky {
     constructor() {
         this.state = {
@@ -31,6 +35,7 @@ class Blinky {
                 view: "panel",
             },
             data: null,
+            dataVersion: null,
             dataFetchState: null,
             renderTime: null,
         };
@@ -49,17 +54,19 @@ class Blinky {
             }
 
             if (this.state.query.view === "table") {
-                gesso.fetch("/data.json", (data) => {
-                    this.state.data = data;
+                gesso.fetch("/data.json?format=2", (data) => {
+                    this.state.data = this.decodeColumnarData(data);
                     window.dispatchEvent(new Event("statechange"));
                 });
             } else {
-                this.state.dataFetchState = gesso.fetchPeriodically("/data.json", (data) => {
-                    this.state.data = data;
-                    window.dispatchEvent(new Event("statechange"));
-                });
+                this.state.dataFetchState = {
+                    currentInterval: 500,
+                    failedAttempts: 0,
+                };
 
-                window.setInterval(() => { this.checkFreshness }, 60 * 1000);
+                this.subscribe();
+
+                window.setInterval(() => { this.checkFreshness(); }, 60 * 1000);
             }
         });
 
@@ -99,8 +106,24 @@ class Blinky {
 
         let status = gesso.createSpan(elem, "#timestamp", time.toLocaleString());
 
+        // Agents are published as they finish, so some may lag
+        for (let agent of Object.values(this.state.data.agents)) {
+            if (agent.update_time == null) {
+                continue;
+            }
+
+            if (this.state.data.update_time - agent.update_time > staleAgentTime) {
+                let agentTime = new Date(agent.update_time);
+
+                gesso.createText(elem, " \u2022 ");
+                gesso.createSpan(elem, "stale-agent", `${agent.name} as of ${agentTime.toLocaleString()}`);
+            }
+        }
+
         gesso.createText(elem, " \u2022 ");
         gesso.createLink(elem, "pretty-data.html?url=/data.json", "Data");
+
+        return elem;
     }
 
     renderViewSelector(parent) {
@@ -438,6 +461,194 @@ class Blinky {
         gesso.replaceElement($("#content"), elem);
     }
 
+    // Listen for update notifications from the server.  If the
+    // browser or the server can't do Server-Sent Events, poll instead.
+    subscribe() {
+        if (window.EventSource == null) {
+            this.fetchDataPeriodically();
+            return;
+        }
+
+        let state = this.state.dataFetchState;
+        let source = new EventSource("/events");
+
+        source.addEventListener("open", (event) => {
+            state.failedAttempts = 0;
+            this.fetchDataDelta();
+        });
+
+        source.addEventListener("update", (event) => {
+            let update = JSON.parse(event.data);
+
+            if (update.version !== this.state.dataVersion) {
+                this.fetchDataDelta();
+            } else {
+                this.applyUpdateTimes(update);
+            }
+        });
+
+        source.addEventListener("error", (event) => {
+            if (source.readyState === EventSource.CLOSED) {
+                console.log("Event stream closed; falling back to polling");
+                this.fetchDataPeriodically();
+            } else {
+                state.failedAttempts++;
+            }
+        });
+
+        // A slow poll in case notifications are silently lost
+        window.setInterval(() => { this.fetchDataDelta(); }, 10 * 60 * 1000);
+    }
+
+    fetchDataPeriodically() {
+        let state = this.state.dataFetchState;
+
+        this.fetchDataDelta();
+
+        window.setTimeout(() => { this.fetchDataPeriodically(); }, state.currentInterval);
+
+        state.currentInterval = Math.min(state.currentInterval * 2, 10 * 60 * 1000);
+    }
+
+    // Fetch only what changed since the data version we have
+    fetchDataDelta() {
+        let state = this.state.dataFetchState;
+        let path = "/data-delta.json";
+
+        if (this.state.dataVersion != null) {
+            path += "?since=" + encodeURIComponent(this.state.dataVersion);
+        }
+
+        let request = gesso.openRequest("GET", path, (event) => {
+            if (event.target.status >= 200 && event.target.status < 300) {
+                state.failedAttempts = 0;
+
+                if (this.applyDataDelta(JSON.parse(event.target.responseText))) {
+                    window.dispatchEvent(new Event("statechange"));
+                }
+            }
+        });
+
+        request.addEventListener("error", (event) => {
+            console.log("Fetch failed");
+            state.failedAttempts++;
+        });
+
+        request.send();
+    }
+
+    // The server sends its update times even when the data didn't
+    // change, so the footer shows that polling is still going on
+    applyUpdateTimes(update) {
+        if (this.state.data == null) {
+            return;
+        }
+
+        this.state.data.update_time = update.update_time;
+
+        for (let [id, time] of Object.entries(update.agents)) {
+            let agent = this.state.data.agents[id];
+
+            if (agent != null) {
+                agent.update_time = time;
+            }
+        }
+
+        let footer = $("#content > .footer");
+
+        if (footer != null) {
+            gesso.replaceElement(footer, this.renderFooter(null));
+        }
+    }
+
+    applyDataDelta(delta) {
+        if (delta.version === this.state.dataVersion) {
+            return false;
+        }
+
+        if (delta.full) {
+            this.state.data = delta.data;
+        } else {
+            for (let name of Object.keys(delta.data)) {
+                let value = delta.data[name];
+
+                if (value !== null && typeof value === "object") {
+                    Object.assign(this.state.data[name], value);
+                } else {
+                    this.state.data[name] = value;
+                }
+            }
+        }
+
+        this.state.dataVersion = delta.version;
+
+        return true;
+    }
+
+    // Convert data in the compact columnar format (format 2) to the
+    // default format
+    decodeColumnarData(data) {
+        let decodeUrl = (value) => {
+            if (Array.isArray(value)) {
+                return data.prefixes[value[0]] + value[1];
+            }
+
+            return value;
+        };
+
+        let decodeCollection = (columns) => {
+            let names = Object.keys(columns);
+            let count = names.length === 0 ? 0 : columns[names[0]].length;
+            let objects = [];
+
+            for (let i = 0; i < count; i++) {
+                let obj = {id: i};
+
+                for (let name of names) {
+                    obj[name] = columns[name][i];
+                }
+
+                objects.push(obj);
+            }
+
+            return objects;
+        };
+
+        let results = decodeCollection(data.results);
+
+        for (let result of results) {
+            delete result.id;
+
+            if (result.status != null) {
+                result.status = data.statuses[result.status];
+            }
+
+            for (let name of ["html_url", "data_url", "tests_url", "logs_url"]) {
+                result[name] = decodeUrl(result[name]);
+            }
+        }
+
+        let jobs = decodeCollection(data.jobs);
+
+        for (let job of jobs) {
+            job.html_url = decodeUrl(job.html_url);
+            job.data_url = decodeUrl(job.data_url);
+            job.previous_result = job.previous_result == null ? null : results[job.previous_result];
+            job.current_result = job.current_result == null ? null : results[job.current_result];
+        }
+
+        return {
+            title: data.title,
+            update_time: data.update_time,
+            categories: decodeCollection(data.categories),
+            groups: decodeCollection(data.groups),
+            components: decodeCollection(data.components),
+            environments: decodeCollection(data.environments),
+            agents: decodeCollection(data.agents),
+            jobs: jobs,
+        };
+    }
+
     checkFreshness() {
         console.log("Checking freshness");
 